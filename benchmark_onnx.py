@@ -0,0 +1,304 @@
+# benchmark_onnx.py
+"""
+Parity and latency benchmarks for the ONNX converters.
+
+For every exported artifact this loads the model in onnxruntime, checks numerical parity with the
+PyTorch reference across a grid of batch sizes and sequence lengths, and measures latency while
+sweeping ORT intra_op/inter_op thread counts and graph optimization levels. Results are written
+as JSON (p50/p95 latency and throughput per configuration) so regressions show up in CI when the
+model or the export code changes.
+
+Usage:
+    python benchmark_onnx.py segbot --output segbot_benchmark.json
+    python benchmark_onnx.py whisper --model-dir whisper_onnx --output whisper_benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+def make_session_options(intra_op_threads=0, inter_op_threads=0, optimization_level="all"):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads # 0 lets ORT pick
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, OPTIMIZATION_LEVELS[optimization_level])
+    return options
+
+def make_session(path, intra_op_threads=0, inter_op_threads=0, optimization_level="all"):
+    import onnxruntime as ort
+
+    options = make_session_options(intra_op_threads, inter_op_threads, optimization_level)
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+def session_configs(intra_op_threads, inter_op_threads, optimization_levels):
+    return [
+        {"intra_op_threads": intra, "inter_op_threads": inter, "optimization_level": level}
+        for intra in intra_op_threads
+        for inter in inter_op_threads
+        for level in optimization_levels
+    ]
+
+def latency_stats(run, items_per_run, runs=20, warmup=3):
+    """Times run() and returns p50/p95/mean latency in ms and throughput in items per second."""
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings)
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "mean_ms": float(timings.mean() * 1000),
+        "throughput_per_s": float(items_per_run / timings.mean()),
+    }
+
+def compare_outputs(reference, output, atol, rtol):
+    reference = np.asarray(reference, dtype=np.float32)
+    output = np.asarray(output, dtype=np.float32)
+    difference = np.abs(reference - output)
+    return {
+        "max_abs_diff": float(difference.max()),
+        "mean_abs_diff": float(difference.mean()),
+        "passed": bool(np.allclose(output, reference, atol=atol, rtol=rtol)),
+    }
+
+# ------------------ SEGBOT ------------------
+
+def segbot_inputs(batch_size, seq_len, input_dim, seed):
+    rng = np.random.default_rng(seed)
+    input_x = rng.standard_normal((batch_size, seq_len, input_dim)).astype(np.float32)
+    lengths = rng.integers(max(seq_len // 2, 1), seq_len + 1, size=batch_size).astype(np.int64)
+    lengths[0] = seq_len
+    start_units = (rng.random(batch_size) * (lengths // 2)).astype(np.int64)
+    return input_x, start_units, lengths
+
+# Reduced-precision variants are held to looser (atol, rtol) than the fp32 graphs
+VARIANT_TOLERANCES = {"int8": (2e-2, 1e-1), "fp16": (2e-3, 2e-2)}
+
+def benchmark_segbot(batch_sizes, seq_lengths, configs, runs, atol, rtol, export_dir, seed=0, variants=()):
+    """
+    Exports SEGBOT with the converter functions and benchmarks segbot.onnx (single pointer step)
+    and the encoder / step-decoder pair (full segmentation) against the same torch model.
+    variants (e.g. ["int8", "fp16"]) also derives those graphs with create_segbot_onnx_variants()
+    and reports their drift from the torch fp32 output, boundary (argmax) agreement and latency.
+    """
+    import torch
+    import convert_segbot_to_onnx as segbot
+
+    torch.manual_seed(seed)
+    model = segbot.SEGBOT(128, 256)
+    model.eval()
+    input_dim = model.encoder.bigru.input_size
+    step_path = os.path.join(export_dir, "segbot.onnx")
+    encoder_path = os.path.join(export_dir, "segbot_encoder.onnx")
+    decoder_path = os.path.join(export_dir, "segbot_decoder_step.onnx")
+    segbot.create_segbot_onnx(step_path, model=model)
+    segbot.create_segbot_decoding_onnx(encoder_path, decoder_path, model=model)
+    variant_paths = segbot.create_segbot_onnx_variants(step_path, variants) if variants else {}
+    variant_paths.pop("fp32", None) # Already covered by the "segbot" rows
+
+    results = []
+    for config in configs:
+        step_session = make_session(step_path, **config)
+        encoder_session = make_session(encoder_path, **config)
+        decoder_session = make_session(decoder_path, **config)
+        variant_sessions = {variant: make_session(path, **config) for variant, path in variant_paths.items()}
+        for batch_size in batch_sizes:
+            for seq_len in seq_lengths:
+                input_x, start_units, lengths = segbot_inputs(batch_size, seq_len, input_dim, seed)
+                with torch.no_grad():
+                    reference = model(torch.from_numpy(input_x), torch.from_numpy(start_units), torch.from_numpy(lengths)).numpy()
+                    reference_boundaries = model.segment(torch.from_numpy(input_x), torch.from_numpy(lengths))
+
+                feeds = {"input_x": input_x, "start_units": start_units, "lengths": lengths}
+                run_step = lambda: step_session.run(None, feeds)[0]
+                results.append({
+                    "artifact": "segbot",
+                    "batch_size": batch_size,
+                    "seq_len": seq_len,
+                    **config,
+                    "parity": compare_outputs(reference, run_step(), atol, rtol),
+                    "latency": latency_stats(run_step, batch_size, runs=runs),
+                })
+
+                for variant, session in variant_sessions.items():
+                    run_variant = lambda session=session: session.run(None, feeds)[0]
+                    output = run_variant()
+                    variant_atol, variant_rtol = VARIANT_TOLERANCES[variant]
+                    parity = compare_outputs(reference, output, variant_atol, variant_rtol)
+                    parity["boundary_agreement"] = float((output[..., 0].argmax(axis=1) == reference[..., 0].argmax(axis=1)).mean())
+                    results.append({
+                        "artifact": f"segbot-{variant}",
+                        "batch_size": batch_size,
+                        "seq_len": seq_len,
+                        **config,
+                        "parity": parity,
+                        "latency": latency_stats(run_variant, batch_size, runs=runs),
+                        "file_size_bytes": os.path.getsize(variant_paths[variant]),
+                    })
+
+                run_segmentation = lambda: segbot.segment_with_onnx(encoder_session, decoder_session, input_x, lengths)
+                boundaries = run_segmentation()
+                results.append({
+                    "artifact": "segbot_decoding",
+                    "batch_size": batch_size,
+                    "seq_len": seq_len,
+                    **config,
+                    "parity": {"boundaries_match": boundaries == reference_boundaries, "passed": boundaries == reference_boundaries},
+                    "latency": latency_stats(run_segmentation, batch_size, runs=runs),
+                })
+    return results
+
+# ------------------ Whisper ------------------
+
+def benchmark_whisper(model_dir, model_name, batch_sizes, decoder_lengths, configs, runs, atol, rtol, seed=0):
+    """
+    Benchmarks a directory written by create_whisper_onnx (any decoder export mode) against the
+    Hugging Face PyTorch model. Sequence lengths are decoder token counts; the encoder always sees
+    30 s (3000 frames) of log-mel features. With a KV-cache export, a single cached decoding step
+    over a prefix of that length is checked and timed as well.
+    """
+    import torch
+    from transformers import WhisperForConditionalGeneration
+    from convert_whisper_to_onnx import ENCODER_FRAMES, WhisperOnnxModel
+
+    model = WhisperForConditionalGeneration.from_pretrained(model_name)
+    model.eval()
+
+    rng = np.random.default_rng(seed)
+    num_mel_bins = model.config.num_mel_bins
+    results = []
+    for config in configs:
+        onnx_model = WhisperOnnxModel(model_dir, session_options=make_session_options(**config))
+        for batch_size in batch_sizes:
+            input_features = rng.standard_normal((batch_size, num_mel_bins, ENCODER_FRAMES)).astype(np.float32)
+            with torch.no_grad():
+                reference_hidden = model.model.encoder(torch.from_numpy(input_features)).last_hidden_state
+
+            run_encoder = lambda: onnx_model.encode(input_features)
+            encoder_hidden = run_encoder()
+            results.append({
+                "artifact": "whisper_encoder",
+                "batch_size": batch_size,
+                "seq_len": ENCODER_FRAMES,
+                **config,
+                "parity": compare_outputs(reference_hidden.numpy(), encoder_hidden, atol, rtol),
+                "latency": latency_stats(run_encoder, batch_size, runs=runs),
+            })
+
+            for decoder_length in decoder_lengths:
+                input_ids = rng.integers(0, model.config.vocab_size, size=(batch_size, decoder_length)).astype(np.int64)
+                with torch.no_grad():
+                    reference_logits = model(encoder_outputs=(reference_hidden,), decoder_input_ids=torch.from_numpy(input_ids)).logits.numpy()
+                run_decoder = lambda: onnx_model.decoder_step(input_ids, encoder_hidden)[0]
+                results.append({
+                    "artifact": "whisper_decoder",
+                    "batch_size": batch_size,
+                    "seq_len": decoder_length,
+                    **config,
+                    "parity": compare_outputs(reference_logits, run_decoder(), atol, rtol),
+                    "latency": latency_stats(run_decoder, batch_size * decoder_length, runs=runs),
+                })
+
+                if not onnx_model.uses_cache or decoder_length < 2:
+                    continue
+                _, past = onnx_model.decoder_step(input_ids[:, :-1], encoder_hidden)
+                run_cached_step = lambda: onnx_model.decoder_step(input_ids[:, -1:], encoder_hidden, past)[0]
+                results.append({
+                    "artifact": "whisper_cached_step",
+                    "batch_size": batch_size,
+                    "seq_len": decoder_length,
+                    **config,
+                    "parity": compare_outputs(reference_logits[:, -1:], run_cached_step(), atol, rtol),
+                    "latency": latency_stats(run_cached_step, batch_size, runs=runs),
+                })
+    return results
+
+# ------------------ Main ------------------
+
+def print_results(results):
+    print(f"{'artifact':<20} {'batch':>5} {'seq':>5} {'intra':>5} {'inter':>5} {'opt':>8} {'parity':>7} {'p50 ms':>9} {'p95 ms':>9} {'items/s':>10}")
+    for result in results:
+        latency = result["latency"]
+        parity = "ok" if result["parity"]["passed"] else "FAIL"
+        print(f"{result['artifact']:<20} {result['batch_size']:>5} {result['seq_len']:>5} {result['intra_op_threads']:>5} "
+              f"{result['inter_op_threads']:>5} {result['optimization_level']:>8} {parity:>7} {latency['p50_ms']:>9.2f} "
+              f"{latency['p95_ms']:>9.2f} {latency['throughput_per_s']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark exported ONNX models against PyTorch")
+    parser.add_argument("target", choices=["segbot", "whisper"])
+    parser.add_argument("--output", help="JSON results file (default: <target>_benchmark.json)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--seq-lengths", type=int, nargs="+",
+                        help="SEGBOT sequence lengths (default: 50 200) / Whisper decoder token counts (default: 1 16)")
+    parser.add_argument("--intra-op-threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--inter-op-threads", type=int, nargs="+", default=[1])
+    parser.add_argument("--optimization-levels", nargs="+", default=["basic", "all"], choices=list(OPTIMIZATION_LEVELS))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--rtol", type=float, default=1e-3)
+    parser.add_argument("--model-dir", default="whisper_onnx", help="Whisper export directory")
+    parser.add_argument("--model-name", default="openai/whisper-base", help="Whisper PyTorch reference model")
+    parser.add_argument("--variants", nargs="*", default=[], choices=list(VARIANT_TOLERANCES),
+                        help="SEGBOT reduced-precision variants to check as well (tolerances: VARIANT_TOLERANCES)")
+    args = parser.parse_args()
+
+    try:
+        import onnxruntime
+        import torch
+    except ImportError:
+        print("onnxruntime and PyTorch are required for benchmarking:")
+        print("pip install onnxruntime torch")
+        sys.exit(1)
+
+    configs = session_configs(args.intra_op_threads, args.inter_op_threads, args.optimization_levels)
+    if args.target == "segbot":
+        with tempfile.TemporaryDirectory() as export_dir:
+            results = benchmark_segbot(args.batch_sizes, args.seq_lengths or [50, 200], configs, args.runs, args.atol, args.rtol,
+                                       export_dir, variants=args.variants)
+    else:
+        results = benchmark_whisper(args.model_dir, args.model_name, args.batch_sizes, args.seq_lengths or [1, 16], configs, args.runs, args.atol, args.rtol)
+
+    print_results(results)
+    report = {
+        "target": args.target,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "onnxruntime": onnxruntime.__version__,
+            "torch": torch.__version__,
+        },
+        "results": results,
+    }
+    output_path = args.output or f"{args.target}_benchmark.json"
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {output_path}")
+
+    failures = [result for result in results if not result["parity"]["passed"]]
+    if failures:
+        print(f"{len(failures)} parity check(s) failed.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
+import os
+import sys
+import time
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-# numpy and scipy.signal are not strictly needed for the model definition itself for ONNX export
-# import numpy as np
-# from scipy.signal import find_peaks
+import numpy as np
+from onnx_cache import ArtifactCache, DEFAULT_CACHE_DIR, cached_export, hash_files, hash_state_dict
+from segbot_processing import pad_sequences
 
 class Encoder(nn.Module):
     def __init__(self, input_dim, hidden_dim):
@@ -11,8 +14,15 @@ class Encoder(nn.Module):
         self.hidden_dim = hidden_dim
         self.bigru = nn.GRU(input_dim, hidden_dim, bidirectional=True, batch_first=True)
 
-    def forward(self, x):
-        h, _ = self.bigru(x)
+    def forward(self, x, lengths=None):
+        if lengths is None:
+            h, _ = self.bigru(x)
+            return h
+        # Packed sequences keep the backward direction from reading padding; ONNX export maps
+        # this onto the GRU sequence_lens input
+        packed = nn.utils.rnn.pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        packed_h, _ = self.bigru(packed)
+        h, _ = nn.utils.rnn.pad_packed_sequence(packed_h, batch_first=True, total_length=x.size(1))
         return h
 
 class Decoder(nn.Module):
@@ -32,15 +42,37 @@ class Pointer(nn.Module):
         self.W2 = nn.Linear(decoder_hidden_dim, decoder_hidden_dim)
         self.v = nn.Linear(decoder_hidden_dim, 1, bias=False)
 
-    def forward(self, encoder_outputs, decoder_state): # decoder_state shape: (batch_size, decoder_hidden_dim)
-        # self.W1(encoder_outputs) shape: (batch_size, seq_len, decoder_hidden_dim)
+    def project_keys(self, encoder_outputs):
+        # The W1 key projection only depends on the encoder outputs, so it can be computed
+        # once per sequence and reused for every decoding step.
+        return self.W1(encoder_outputs) # Shape: (batch_size, seq_len, decoder_hidden_dim)
+
+    def forward(self, encoder_outputs, decoder_state, keys=None, mask=None): # decoder_state shape: (batch_size, decoder_hidden_dim)
+        # keys (self.W1(encoder_outputs)) shape: (batch_size, seq_len, decoder_hidden_dim)
         # self.W2(decoder_state) shape: (batch_size, decoder_hidden_dim)
+        # mask (optional) shape: (batch_size, seq_len), True for positions that cannot be pointed at
+        if keys is None:
+            keys = self.project_keys(encoder_outputs)
         # Unsqueeze and expand W2 output to allow broadcasted addition
-        expanded_decoder_state = self.W2(decoder_state).unsqueeze(1).expand_as(self.W1(encoder_outputs))
-        scores = self.v(torch.tanh(self.W1(encoder_outputs) + expanded_decoder_state))
+        expanded_decoder_state = self.W2(decoder_state).unsqueeze(1).expand_as(keys)
+        scores = self.v(torch.tanh(keys + expanded_decoder_state))
+        if mask is not None:
+            scores = scores.masked_fill(mask.unsqueeze(-1), float("-inf"))
         attention_weights = F.softmax(scores, dim=1) # Softmax over sequence dimension
         return attention_weights
 
+def gather_start_units(encoder_outputs, start_units):
+    # Picks encoder_outputs[row, start_units[row]] for every row with a graph-level Gather,
+    # so the start index is not baked into an exported model as a constant.
+    # encoder_outputs: (batch_size, seq_len, features), start_units: (batch_size,) -> (batch_size, 1, features)
+    gather_index = start_units.view(-1, 1, 1).expand(-1, 1, encoder_outputs.size(2))
+    return torch.gather(encoder_outputs, 1, gather_index)
+
+def padding_mask(lengths, seq_len):
+    # True for positions at or beyond each row's length: (batch_size,) -> (batch_size, seq_len)
+    positions = torch.arange(seq_len, device=lengths.device).unsqueeze(0)
+    return positions >= lengths.unsqueeze(1)
+
 class SEGBOT(nn.Module):
     def __init__(self, input_dim, hidden_dim):
         super(SEGBOT, self).__init__()
@@ -48,18 +80,20 @@ class SEGBOT(nn.Module):
         self.decoder = Decoder(hidden_dim) # Decoder hidden_dim is the same as Encoder's hidden_dim (not *2)
         self.pointer = Pointer(hidden_dim * 2, hidden_dim) # encoder_hidden_dim is hidden_dim * 2
 
-    def forward(self, input_x, start_units_tensor):
-        encoder_outputs = self.encoder(input_x) # Shape: (batch_size, seq_len, hidden_dim * 2)
+    def forward(self, input_x, start_units_tensor, lengths=None):
+        # lengths (optional) shape: (batch_size,) - number of real units per row of a padded batch
+        encoder_outputs = self.encoder(input_x, lengths) # Shape: (batch_size, seq_len, hidden_dim * 2)
         
         batch_size = input_x.size(0)
         # Initial decoder hidden state: (1, batch_size, decoder_hidden_dim)
         decoder_hidden = torch.zeros(1, batch_size, self.decoder.hidden_dim).to(input_x.device)
         
-        # Get start_index as Python scalar for slicing, assuming start_units_tensor is 0-D
-        # This makes start_index a constant during tracing for ONNX export, which is required for slicing.
-        start_index = start_units_tensor.item() 
+        # start_units_tensor holds one start index per batch row, shape (batch_size,). A 0-D or
+        # single-element tensor is broadcast to every row. The indices stay graph inputs (no .item()),
+        # so one exported model serves every start position.
+        start_units = start_units_tensor.reshape(-1).expand(batch_size)
         # Decoder input: (batch_size, 1, hidden_dim * 2)
-        decoder_inputs = encoder_outputs[:, start_index:start_index+1, :] 
+        decoder_inputs = gather_start_units(encoder_outputs, start_units)
 
         # decoder_outputs shape: (batch_size, 1, decoder_hidden_dim)
         # hidden_state shape: (1, batch_size, decoder_hidden_dim)
@@ -68,49 +102,512 @@ class SEGBOT(nn.Module):
         # Squeeze decoder_outputs to (batch_size, decoder_hidden_dim) for Pointer network
         squeezed_decoder_outputs = decoder_outputs.squeeze(1)
         
-        attention_weights = self.pointer(encoder_outputs, squeezed_decoder_outputs) # attention_weights shape: (batch_size, seq_len, 1)
+        # Padding positions get no attention weight
+        mask = padding_mask(lengths, input_x.size(1)) if lengths is not None else None
+        attention_weights = self.pointer(encoder_outputs, squeezed_decoder_outputs, mask=mask) # attention_weights shape: (batch_size, seq_len, 1)
         return attention_weights
 
+    # --- Incremental decoding API ---
+    # encode() runs the BiGRU encoder and the W1 key projection once per sequence, and
+    # decode_step() runs a single pointer step against those cached tensors. segment() chains
+    # the two to emit every boundary of a sequence without re-running the encoder.
+
+    def init_decoder_hidden(self, batch_size, device=None):
+        # Initial decoder hidden state: (1, batch_size, decoder_hidden_dim)
+        return torch.zeros(1, batch_size, self.decoder.hidden_dim, device=device)
+
+    def encode(self, input_x, lengths=None):
+        encoder_outputs = self.encoder(input_x, lengths) # Shape: (batch_size, seq_len, hidden_dim * 2)
+        keys = self.pointer.project_keys(encoder_outputs) # Shape: (batch_size, seq_len, hidden_dim)
+        return encoder_outputs, keys
+
+    def decode_step(self, encoder_outputs, keys, decoder_hidden, start_units, lengths=None):
+        # start_units shape: (batch_size,) - index of the first unit of the segment being decoded, per row
+        # lengths (optional) shape: (batch_size,) - number of real units per row of a padded batch
+        seq_len = encoder_outputs.size(1)
+        decoder_inputs = gather_start_units(encoder_outputs, start_units) # Shape: (batch_size, 1, hidden_dim * 2)
+
+        decoder_outputs, decoder_hidden = self.decoder(decoder_inputs, decoder_hidden)
+
+        # A segment cannot end before it starts, so positions before start_units are masked out
+        positions = torch.arange(seq_len, device=encoder_outputs.device).unsqueeze(0)
+        mask = positions < start_units.unsqueeze(1)
+        if lengths is not None:
+            mask = mask | padding_mask(lengths, seq_len)
+        attention_weights = self.pointer(encoder_outputs, decoder_outputs.squeeze(1), keys=keys, mask=mask)
+
+        # The unit after the predicted boundary starts the next segment
+        next_start_units = torch.argmax(attention_weights.squeeze(2), dim=1) + 1
+        return attention_weights, decoder_hidden, next_start_units
+
+    @torch.no_grad()
+    def segment(self, input_x, lengths=None):
+        """
+        Greedily decodes every segment boundary of each sequence in input_x.
+        lengths (optional) gives the number of real units per row of a padded batch.
+        Returns one list of boundary indices (the last unit of each segment) per batch row.
+        """
+        batch_size, seq_len = input_x.size(0), input_x.size(1)
+        encoder_outputs, keys = self.encode(input_x, lengths)
+        if lengths is None:
+            lengths = torch.full((batch_size,), seq_len, dtype=torch.long, device=input_x.device)
+        decoder_hidden = self.init_decoder_hidden(batch_size, input_x.device)
+        start_units = torch.zeros(batch_size, dtype=torch.long, device=input_x.device)
+
+        boundaries = [[] for _ in range(batch_size)]
+        done = torch.zeros(batch_size, dtype=torch.bool, device=input_x.device)
+        # Every step consumes at least one unit, so seq_len steps always suffice
+        for _ in range(seq_len):
+            _, decoder_hidden, next_start_units = self.decode_step(encoder_outputs, keys, decoder_hidden, start_units, lengths)
+            for row in torch.nonzero(~done).flatten().tolist():
+                boundaries[row].append(int(next_start_units[row]) - 1)
+            done |= next_start_units >= lengths
+            if bool(done.all()):
+                break
+            # Finished rows keep decoding a valid index; their outputs are ignored
+            start_units = torch.minimum(next_start_units, lengths - 1)
+        return boundaries
+
+class SEGBOTEncoder(nn.Module):
+    """Export wrapper: (input_x, lengths) -> (encoder_outputs, keys)."""
+    def __init__(self, model):
+        super(SEGBOTEncoder, self).__init__()
+        self.model = model
+
+    def forward(self, input_x, lengths):
+        return self.model.encode(input_x, lengths)
+
+class SEGBOTDecoderStep(nn.Module):
+    """Export wrapper: one pointer step over cached encoder outputs and keys."""
+    def __init__(self, model):
+        super(SEGBOTDecoderStep, self).__init__()
+        self.model = model
+
+    def forward(self, encoder_outputs, keys, decoder_hidden, start_units, lengths):
+        return self.model.decode_step(encoder_outputs, keys, decoder_hidden, start_units, lengths)
+
+def segment_with_onnx(encoder_session, decoder_session, input_x, lengths=None):
+    """
+    Runs the exported encoder once and the step-decoder until every row reaches the end of
+    its sequence. input_x is a float32 array of shape (batch_size, seq_len, input_dim);
+    lengths (optional) gives the number of real units per row of a padded batch.
+    Returns one list of boundary indices per batch row, matching SEGBOT.segment().
+    """
+    input_x = np.ascontiguousarray(input_x, dtype=np.float32)
+    batch_size, seq_len = input_x.shape[0], input_x.shape[1]
+    if lengths is None:
+        lengths = np.full(batch_size, seq_len, dtype=np.int64)
+    lengths = np.ascontiguousarray(lengths, dtype=np.int64)
+    encoder_outputs, keys = encoder_session.run(None, {"input_x": input_x, "lengths": lengths})
+    hidden_dim = keys.shape[2]
+    decoder_hidden = np.zeros((1, batch_size, hidden_dim), dtype=np.float32)
+    start_units = np.zeros(batch_size, dtype=np.int64)
+
+    boundaries = [[] for _ in range(batch_size)]
+    done = np.zeros(batch_size, dtype=bool)
+    for _ in range(seq_len):
+        _, decoder_hidden, next_start_units = decoder_session.run(None, {
+            "encoder_outputs": encoder_outputs,
+            "keys": keys,
+            "decoder_hidden": decoder_hidden,
+            "start_units": start_units,
+            "lengths": lengths,
+        })
+        for row in np.flatnonzero(~done):
+            boundaries[row].append(int(next_start_units[row]) - 1)
+        done |= next_start_units >= lengths
+        if done.all():
+            break
+        start_units = np.minimum(next_start_units, lengths - 1)
+    return boundaries
+
+# --- Variable-length batching ---
+
+def bucket_by_length(lengths, max_batch_size=64, max_tokens=None):
+    """
+    Groups sequence indices into batches of similar length so little compute is spent on padding.
+    Each batch has at most max_batch_size rows and, if max_tokens is set, at most max_tokens
+    padded units (rows * longest length). Returns a list of index arrays into lengths.
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind="stable")
+    buckets = []
+    current = []
+    for index in order:
+        # Sorted ascending, so the candidate is always the longest row of the batch
+        padded_tokens = (len(current) + 1) * int(lengths[index])
+        if current and (len(current) >= max_batch_size or (max_tokens is not None and padded_tokens > max_tokens)):
+            buckets.append(np.array(current))
+            current = []
+        current.append(index)
+    if current:
+        buckets.append(np.array(current))
+    return buckets
+
+def segment_sequences(model, sequences, max_batch_size=64, max_tokens=None):
+    """
+    Segments many variable-length (seq_len_i, input_dim) feature arrays with the torch model,
+    batching them by length. Returns one list of boundary indices per sequence, in input order.
+    """
+    boundaries = [None] * len(sequences)
+    lengths = [len(sequence) for sequence in sequences]
+    for bucket in bucket_by_length(lengths, max_batch_size, max_tokens):
+        input_x, bucket_lengths = pad_sequences([sequences[index] for index in bucket])
+        bucket_boundaries = model.segment(torch.from_numpy(input_x), torch.from_numpy(bucket_lengths))
+        for index, row_boundaries in zip(bucket, bucket_boundaries):
+            boundaries[index] = row_boundaries
+    return boundaries
+
+def segment_sequences_with_onnx(encoder_session, decoder_session, sequences, max_batch_size=64, max_tokens=None):
+    """ONNX Runtime counterpart of segment_sequences() using the exported encoder / step-decoder pair."""
+    boundaries = [None] * len(sequences)
+    lengths = [len(sequence) for sequence in sequences]
+    for bucket in bucket_by_length(lengths, max_batch_size, max_tokens):
+        input_x, bucket_lengths = pad_sequences([sequences[index] for index in bucket])
+        bucket_boundaries = segment_with_onnx(encoder_session, decoder_session, input_x, bucket_lengths)
+        for index, row_boundaries in zip(bucket, bucket_boundaries):
+            boundaries[index] = row_boundaries
+    return boundaries
+
+# --- Streaming segmentation for very long inputs ---
+
+def iter_feature_chunks(features, chunk_size=1024):
+    # Accepts a (seq_len, input_dim) array (np.memmap works and is read lazily) or any iterable
+    # of (n_i, input_dim) chunks, and yields float32 chunks without materialising the whole input.
+    if isinstance(features, np.ndarray):
+        for begin in range(0, len(features), chunk_size):
+            yield np.asarray(features[begin:begin + chunk_size], dtype=np.float32)
+    else:
+        for chunk in features:
+            yield np.atleast_2d(np.asarray(chunk, dtype=np.float32))
+
+def stream_segment_windows(segment_window, features, window_size=512, overlap=128):
+    """
+    Walks features in overlapping windows and yields global boundary indices as soon as they are final.
+
+    segment_window maps a (window_len, input_dim) array to that window's boundary indices.
+    Boundaries that fall in the last `overlap` units of a window lack right context, so they are
+    dropped and re-decoded by the next window, which starts right after the last boundary kept.
+    A window that keeps no boundary at all (a segment longer than window_size - overlap units) ends
+    with a forced boundary at its last committable unit, window start + window_size - overlap - 1,
+    which is yielded like any other; boundaries then match SEGBOT.segment() on the whole sequence
+    only as long as no segment is that long. This keeps about one window of features in memory
+    regardless of the input length.
+    """
+    if not 0 <= overlap < window_size:
+        raise ValueError("overlap must be in [0, window_size)")
+
+    chunks = iter_feature_chunks(features)
+    buffer = None
+    buffer_start = 0 # Global index of buffer[0]
+    exhausted = False
+    while True:
+        # Top the buffer up to one full window (or whatever is left of the input)
+        pending = [] if buffer is None else [buffer]
+        buffered = 0 if buffer is None else len(buffer)
+        while not exhausted and buffered < window_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                break
+            pending.append(chunk)
+            buffered += len(chunk)
+        if buffered == 0:
+            return
+        buffer = np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+        window = buffer[:window_size]
+        is_last_window = exhausted and len(buffer) <= window_size
+        window_boundaries = segment_window(window)
+        if is_last_window:
+            for boundary in window_boundaries:
+                yield buffer_start + boundary
+            return
+
+        # Keep boundaries left of the overlap region; the next window decides the rest
+        commit_limit = len(window) - overlap
+        committed = [boundary for boundary in window_boundaries if boundary < commit_limit]
+        if not committed:
+            committed = [commit_limit - 1] # Forced, so the next window really starts a segment
+        for boundary in committed:
+            yield buffer_start + boundary
+        next_start = committed[-1] + 1
+        buffer = buffer[next_start:]
+        buffer_start += next_start
+
+def stream_segment(model, features, window_size=512, overlap=128):
+    """Streaming counterpart of SEGBOT.segment() for a single long (seq_len, input_dim) input."""
+    def segment_window(window):
+        return model.segment(torch.from_numpy(np.ascontiguousarray(window)).unsqueeze(0))[0]
+    return stream_segment_windows(segment_window, features, window_size, overlap)
+
+def stream_segment_with_onnx(encoder_session, decoder_session, features, window_size=512, overlap=128):
+    """ONNX Runtime counterpart of stream_segment() using the exported encoder / step-decoder pair."""
+    def segment_window(window):
+        return segment_with_onnx(encoder_session, decoder_session, window[np.newaxis])[0]
+    return stream_segment_windows(segment_window, features, window_size, overlap)
+
 # --- Conversion part of the script ---
-def create_segbot_onnx(onnx_file_path="segbot.onnx"):
+
+OPSET_VERSION = 11 # A commonly used opset version
+
+# For attention_weights, the output is (batch_size, seq_len, 1), so sequence_length is dim 1.
+SEGBOT_DYNAMIC_AXES = {
+    "input_x": {0: "batch_size", 1: "sequence_length"},
+    "start_units": {0: "batch_size"}, # One start index per row
+    "lengths": {0: "batch_size"}, # One length per row
+    "attention_weights": {0: "batch_size", 1: "sequence_length"}
+}
+
+SEGBOT_ENCODER_DYNAMIC_AXES = {
+    "input_x": {0: "batch_size", 1: "sequence_length"},
+    "lengths": {0: "batch_size"},
+    "encoder_outputs": {0: "batch_size", 1: "sequence_length"},
+    "keys": {0: "batch_size", 1: "sequence_length"},
+}
+
+SEGBOT_DECODER_DYNAMIC_AXES = {
+    "encoder_outputs": {0: "batch_size", 1: "sequence_length"},
+    "keys": {0: "batch_size", 1: "sequence_length"},
+    "decoder_hidden": {1: "batch_size"},
+    "start_units": {0: "batch_size"},
+    "lengths": {0: "batch_size"},
+    "attention_weights": {0: "batch_size", 1: "sequence_length"},
+    "next_decoder_hidden": {1: "batch_size"},
+    "next_start_units": {0: "batch_size"},
+}
+
+def segbot_cache_description(artifact, files, **details):
+    # Everything that determines an exported artifact; the cache key is a hash of this
+    return {
+        "artifact": artifact,
+        "files": files,
+        "converter": hash_files([os.path.abspath(__file__)]),
+        **details,
+    }
+
+def segbot_model_description(model):
+    return {
+        "weights": hash_state_dict(model.state_dict()),
+        "config": {"input_dim": model.encoder.bigru.input_size, "hidden_dim": model.encoder.hidden_dim},
+        "opset": OPSET_VERSION,
+        "exporter": {"torch": torch.__version__},
+    }
+
+def create_segbot_onnx(onnx_file_path="segbot.onnx", model=None, cache=None, force=False):
     input_dim = 128
     hidden_dim = 256
-    model = SEGBOT(input_dim, hidden_dim)
+    if model is None:
+        model = SEGBOT(input_dim, hidden_dim)
     model.eval() # Set model to evaluation mode
 
     # Dummy inputs matching the forward method signature (input_x, start_units_tensor)
     # batch_size=1, sequence_length=50 (arbitrary sequence length for dummy input)
-    dummy_x = torch.randn(1, 50, input_dim) 
+    dummy_x = torch.randn(1, 50, model.encoder.bigru.input_size) 
     
-    # start_units_tensor should be a 0-D tensor for .item() to work and for scalar-like input
-    dummy_start_units = torch.tensor(0, dtype=torch.long) 
+    # start_units holds one start index per batch row; a non-zero dummy keeps the exporter
+    # from specialising the gather on index 0
+    dummy_start_units = torch.tensor([3], dtype=torch.long) 
 
-    input_names = ["input_x", "start_units"]
+    # lengths holds the number of real units per row of a padded batch
+    dummy_lengths = torch.tensor([50], dtype=torch.long)
+
+    input_names = ["input_x", "start_units", "lengths"]
     output_names = ["attention_weights"]
-    
-    # Define dynamic axes for batch_size and sequence_length
-    # For attention_weights, the output is (batch_size, seq_len, 1).
-    # So, sequence_length is dim 1.
-    dynamic_axes = {
-        "input_x": {0: "batch_size", 1: "sequence_length"},
-        "start_units": {}, # Scalar, no dynamic axes
-        "attention_weights": {0: "batch_size", 1: "sequence_length"}
-    }
 
-    print(f"Exporting SEGBOT model to {onnx_file_path}...")
-    torch.onnx.export(
-        model,
-        (dummy_x, dummy_start_units), # Tuple of inputs
-        onnx_file_path,
-        export_params=True, # Store learned parameters in the ONNX file
-        opset_version=11,   # A commonly used opset version
-        do_constant_folding=True, # Optimize by folding constants
-        input_names=input_names,
-        output_names=output_names,
-        dynamic_axes=dynamic_axes,
-    )
+    def export():
+        print(f"Exporting SEGBOT model to {onnx_file_path}...")
+        torch.onnx.export(
+            model,
+            (dummy_x, dummy_start_units, dummy_lengths), # Tuple of inputs
+            onnx_file_path,
+            export_params=True, # Store learned parameters in the ONNX file
+            opset_version=OPSET_VERSION,
+            do_constant_folding=True, # Optimize by folding constants
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=SEGBOT_DYNAMIC_AXES,
+        )
+
+    output_dir = os.path.dirname(onnx_file_path) or "."
+    file_name = os.path.basename(onnx_file_path)
+    description = segbot_cache_description("segbot", [file_name], dynamic_axes=SEGBOT_DYNAMIC_AXES, **segbot_model_description(model))
+    cached_export(cache, description, output_dir, [file_name], export, force)
     print(f"SEGBOT ONNX export complete. Model saved to {onnx_file_path}")
 
+def create_segbot_decoding_onnx(encoder_file_path="segbot_encoder.onnx", decoder_file_path="segbot_decoder_step.onnx", model=None, cache=None, force=False):
+    """
+    Exports the encoder / step-decoder pair used by segment_with_onnx(). The encoder is run
+    once per sequence; the step-decoder carries the GRU hidden state and next start index.
+    """
+    input_dim = 128
+    hidden_dim = 256
+    if model is None:
+        model = SEGBOT(input_dim, hidden_dim)
+    model.eval()
+
+    dummy_x = torch.randn(2, 50, model.encoder.bigru.input_size)
+    dummy_lengths = torch.tensor([50, 37], dtype=torch.long)
+    with torch.no_grad():
+        dummy_encoder_outputs, dummy_keys = model.encode(dummy_x, dummy_lengths)
+    dummy_hidden = model.init_decoder_hidden(2)
+    dummy_start_units = torch.tensor([0, 3], dtype=torch.long)
+
+    def export():
+        print(f"Exporting SEGBOT encoder to {encoder_file_path}...")
+        torch.onnx.export(
+            SEGBOTEncoder(model),
+            (dummy_x, dummy_lengths),
+            encoder_file_path,
+            export_params=True,
+            opset_version=OPSET_VERSION,
+            do_constant_folding=True,
+            input_names=["input_x", "lengths"],
+            output_names=["encoder_outputs", "keys"],
+            dynamic_axes=SEGBOT_ENCODER_DYNAMIC_AXES,
+        )
+
+        print(f"Exporting SEGBOT step-decoder to {decoder_file_path}...")
+        torch.onnx.export(
+            SEGBOTDecoderStep(model),
+            (dummy_encoder_outputs, dummy_keys, dummy_hidden, dummy_start_units, dummy_lengths),
+            decoder_file_path,
+            export_params=True,
+            opset_version=OPSET_VERSION,
+            do_constant_folding=True,
+            input_names=["encoder_outputs", "keys", "decoder_hidden", "start_units", "lengths"],
+            output_names=["attention_weights", "next_decoder_hidden", "next_start_units"],
+            dynamic_axes=SEGBOT_DECODER_DYNAMIC_AXES,
+        )
+
+    output_dir = os.path.dirname(encoder_file_path) or "."
+    files = [os.path.basename(encoder_file_path), os.path.relpath(decoder_file_path, output_dir)]
+    description = segbot_cache_description(
+        "segbot-decoding", files,
+        dynamic_axes={"encoder": SEGBOT_ENCODER_DYNAMIC_AXES, "decoder": SEGBOT_DECODER_DYNAMIC_AXES},
+        **segbot_model_description(model),
+    )
+    cached_export(cache, description, output_dir, files, export, force)
+    print(f"SEGBOT decoding export complete. Models saved to {encoder_file_path} and {decoder_file_path}")
+
+# --- Quantized and half-precision variants ---
+
+def segbot_variant_path(onnx_file_path, variant):
+    # segbot.onnx -> segbot.int8.onnx / segbot.fp16.onnx
+    root, ext = os.path.splitext(onnx_file_path)
+    return f"{root}.{variant}{ext}"
+
+def quantize_segbot_dynamic(model):
+    """Torch dynamic INT8 quantization of the GRU and Linear layers, for CPU inference in PyTorch."""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+def create_segbot_onnx_variants(onnx_file_path="segbot.onnx", variants=("int8", "fp16"), cache=None, force=False):
+    """
+    Derives cheaper variants from an exported fp32 SEGBOT model:
+      int8 - dynamic INT8 quantization of the Linear (MatMul/Gemm) weights. ONNX Runtime has no
+             integer GRU kernel, so the GRUs stay fp32 in the ONNX variant; quantize_segbot_dynamic()
+             covers GRU + Linear for torch inference.
+      fp16 - weights and activations in float16, with float32 inputs/outputs kept so callers are unchanged.
+    Returns a dict of variant name -> file path, including "fp32" for the source model.
+    """
+    try:
+        import onnx
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+    except ImportError:
+        print("onnx and onnxruntime are required to build SEGBOT variants:")
+        print("pip install onnx onnxruntime")
+        return {"fp32": onnx_file_path}
+
+    import onnxruntime
+
+    paths = {"fp32": onnx_file_path}
+    source_hash = hash_files([onnx_file_path])
+    for variant in variants:
+        if variant not in ("int8", "fp16"):
+            raise ValueError(f"Unknown SEGBOT variant: {variant}")
+        variant_path = segbot_variant_path(onnx_file_path, variant)
+
+        def export(variant=variant, variant_path=variant_path):
+            print(f"Creating {variant} SEGBOT variant at {variant_path}...")
+            if variant == "int8":
+                quantize_dynamic(onnx_file_path, variant_path, weight_type=QuantType.QInt8)
+            else:
+                onnx.save(convert_float_to_float16(onnx.load(onnx_file_path), keep_io_types=True), variant_path)
+
+        file_name = os.path.basename(variant_path)
+        description = segbot_cache_description(
+            f"segbot-{variant}", [file_name],
+            source=source_hash,
+            quantization=variant,
+            exporter={"onnx": onnx.__version__, "onnxruntime": onnxruntime.__version__},
+        )
+        cached_export(cache, description, os.path.dirname(variant_path) or ".", [file_name], export, force)
+        paths[variant] = variant_path
+    return paths
+
+def measure_latency_ms(run, runs=20, warmup=3):
+    # Median wall time of run() in milliseconds
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def segbot_variant_report(model, variant_paths, batch_size=8, seq_len=200, runs=20, seed=0):
+    """
+    Compares each exported variant (and the torch INT8 model) against the fp32 torch reference on
+    random padded inputs: attention-weight deviation, boundary (argmax) agreement, median CPU
+    latency and file size. Prints a table and returns one dict per variant.
+    """
+    import onnxruntime as ort
+
+    model.eval()
+    generator = torch.Generator().manual_seed(seed)
+    input_dim = model.encoder.bigru.input_size
+    input_x = torch.randn(batch_size, seq_len, input_dim, generator=generator)
+    lengths = torch.randint(seq_len // 2, seq_len + 1, (batch_size,), generator=generator)
+    lengths[0] = seq_len
+    start_units = (torch.rand(batch_size, generator=generator) * (lengths // 2)).long()
+    with torch.no_grad():
+        reference = model(input_x, start_units, lengths).numpy()
+
+    feeds = {"input_x": input_x.numpy(), "start_units": start_units.numpy(), "lengths": lengths.numpy()}
+    candidates = []
+    for variant, path in variant_paths.items():
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        candidates.append((f"onnx-{variant}", lambda session=session: session.run(None, feeds)[0], os.path.getsize(path)))
+    quantized_model = quantize_segbot_dynamic(model)
+    def run_quantized_model():
+        with torch.no_grad():
+            return quantized_model(input_x, start_units, lengths).numpy()
+    candidates.append(("torch-int8", run_quantized_model, None))
+
+    valid = ~padding_mask(lengths, seq_len).numpy()
+    reference_boundaries = reference[..., 0].argmax(axis=1)
+    rows = []
+    for name, run, file_size in candidates:
+        output = np.asarray(run(), dtype=np.float32)
+        deviation = np.abs(output - reference)[..., 0][valid]
+        rows.append({
+            "variant": name,
+            "max_abs_deviation": float(deviation.max()),
+            "mean_abs_deviation": float(deviation.mean()),
+            "boundary_agreement": float((output[..., 0].argmax(axis=1) == reference_boundaries).mean()),
+            "latency_ms": measure_latency_ms(run, runs=runs),
+            "file_size_bytes": file_size,
+        })
+
+    print(f"{'variant':<12} {'max dev':>10} {'mean dev':>10} {'agree':>7} {'latency ms':>11} {'size MB':>8}")
+    for row in rows:
+        size = f"{row['file_size_bytes'] / 1e6:.2f}" if row["file_size_bytes"] is not None else "-"
+        print(f"{row['variant']:<12} {row['max_abs_deviation']:>10.2e} {row['mean_abs_deviation']:>10.2e} "
+              f"{row['boundary_agreement']:>7.2%} {row['latency_ms']:>11.2f} {size:>8}")
+    return rows
+
 if __name__ == "__main__":
     # This part is for making the script runnable
     # It requires torch to be installed in the environment where it's run.
@@ -120,9 +617,41 @@ if __name__ == "__main__":
         import torch
         import torch.nn as nn
         import torch.nn.functional as F
-        create_segbot_onnx()
+        import argparse
+        parser = argparse.ArgumentParser(description="Export SEGBOT to ONNX")
+        parser.add_argument("--variants", nargs="*", default=["int8", "fp16"], choices=["int8", "fp16"],
+                            help="Reduced-precision variants to derive from segbot.onnx")
+        parser.add_argument("--report", action="store_true",
+                            help="Compare the variants against the fp32 torch model")
+        parser.add_argument("--input-dim", type=int, default=128)
+        parser.add_argument("--hidden-dim", type=int, default=256)
+        parser.add_argument("--output-dir", default=".", help="Directory to save the ONNX model files")
+        parser.add_argument("--checkpoint", help="state_dict to load into the model before export")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the initial weights when no checkpoint is given")
+        parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Artifact cache directory")
+        parser.add_argument("--no-cache", action="store_true", help="Always export without touching the cache")
+        parser.add_argument("--force", action="store_true", help="Re-export even if the cache has a matching artifact")
+        args = parser.parse_args()
+
+        torch.manual_seed(args.seed) # Reproducible weights keep the artifact cache effective
+        model = SEGBOT(args.input_dim, args.hidden_dim)
+        if args.checkpoint:
+            model.load_state_dict(torch.load(args.checkpoint, map_location="cpu"))
+        model.eval()
+        cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+        os.makedirs(args.output_dir, exist_ok=True)
+        onnx_file_path = os.path.join(args.output_dir, "segbot.onnx")
+        create_segbot_onnx(onnx_file_path, model=model, cache=cache, force=args.force)
+        create_segbot_decoding_onnx(os.path.join(args.output_dir, "segbot_encoder.onnx"),
+                                    os.path.join(args.output_dir, "segbot_decoder_step.onnx"),
+                                    model=model, cache=cache, force=args.force)
+        variant_paths = create_segbot_onnx_variants(onnx_file_path, args.variants, cache=cache, force=args.force)
+        if args.report:
+            segbot_variant_report(model, variant_paths)
     except ImportError:
         print("PyTorch is not installed. This script requires PyTorch to run.")
         print("Please install PyTorch and try again.")
+        sys.exit(1)
     except Exception as e:
         print(f"An error occurred during SEGBOT ONNX conversion: {e}")
+        sys.exit(1)
@@ -1,39 +1,439 @@
 # convert_whisper_to_onnx.py
+import json
+import os
+import shutil
+import sys
+import tempfile
 
-def create_whisper_onnx():
+import numpy as np
+from onnx_cache import ArtifactCache, DEFAULT_CACHE_DIR, cached_export, hash_files
+
+# Export modes for the decoder:
+#   merged  - one decoder_model_merged.onnx that switches between the first step and the
+#             cached steps through its use_cache_branch input
+#   split   - decoder_model.onnx for the first step and decoder_with_past_model.onnx for the rest
+#   no-past - decoder_model.onnx only; every generated token re-attends over the full prefix
+# "decoders" lists the decoder files WhisperOnnxModel loads for each mode, first step first.
+EXPORT_MODES = {
+    "merged": {"task": "automatic-speech-recognition-with-past", "no_post_process": False,
+               "decoders": ["decoder_model_merged.onnx"]},
+    "split": {"task": "automatic-speech-recognition-with-past", "no_post_process": True,
+              "decoders": ["decoder_model.onnx", "decoder_with_past_model.onnx"]},
+    "no-past": {"task": "automatic-speech-recognition", "no_post_process": False,
+                "decoders": ["decoder_model.onnx"]},
+}
+DECODER_FILES = sorted({name for export_mode in EXPORT_MODES.values() for name in export_mode["decoders"]})
+# Written next to the exported files; records which mode the directory holds
+EXPORT_MANIFEST = "export_manifest.json"
+
+# Whisper always encodes 30 s of audio: 3000 log-mel frames at a 10 ms hop
+ENCODER_FRAMES = 3000
+
+def pin_encoder_input_shape(encoder_path, num_mel_bins, num_frames=ENCODER_FRAMES):
+    """
+    Replaces the dynamic feature/frame axes of the encoder input with the fixed Whisper shape
+    (batch_size, num_mel_bins, 3000) so ONNX Runtime can fully optimize the encoder graph.
+    The batch axis stays dynamic.
+    """
+    import onnx
+
+    # External weight files (large checkpoints) keep their relative locations when re-saved in place
+    model = onnx.load(encoder_path, load_external_data=False)
+    for graph_input in model.graph.input:
+        if graph_input.name == "input_features":
+            dims = graph_input.type.tensor_type.shape.dim
+            dims[1].dim_value = num_mel_bins
+            dims[2].dim_value = num_frames
+    onnx.save(model, encoder_path)
+
+def whisper_model_fingerprint(model_name):
     """
-    Converts the openai/whisper-base model to ONNX format using Hugging Face Optimum.
+    Identifies the weights/config of a Whisper checkpoint without downloading it: a content hash
+    for a local directory, the Hub commit sha otherwise. Returns None when neither is available.
     """
+    if os.path.isdir(model_name):
+        names = [name for name in os.listdir(model_name) if name.endswith((".json", ".safetensors", ".bin", ".txt"))]
+        return hash_files([os.path.join(model_name, name) for name in names])
     try:
-        from optimum.exporters.onnx import main_export
-    except ImportError:
-        print("Optimum library not found. Please install it with ONNX export support:")
-        print("pip install optimum[exporters]")
-        return
+        from huggingface_hub import HfApi
+        return HfApi().model_info(model_name).sha
+    except Exception:
+        return None
+
+def package_versions(*packages):
+    from importlib import metadata
+
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+def list_files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
 
-    model_name = "openai/whisper-base"
-    output_dir = "whisper_onnx" # Directory to save the ONNX model files
-    task = "automatic-speech-recognition"
+def prune_unused_decoders(export_dir, mode):
+    """
+    Deletes the .onnx / .onnx_data files in export_dir other than the encoder and the decoders
+    of mode. Optimum keeps the with/without-past decoders next to the merged one it builds from
+    them, which would more than double what a merged export stores.
+    """
+    keep = {"encoder_model.onnx"} | set(EXPORT_MODES[mode]["decoders"])
+    for name in os.listdir(export_dir):
+        graph_name = name[:-len("_data")] if name.endswith(".onnx_data") else name
+        if graph_name.endswith(".onnx") and graph_name not in keep:
+            os.remove(os.path.join(export_dir, name))
+
+def install_export(staging_dir, output_dir):
+    """
+    Moves a finished export from staging_dir into output_dir. Decoder files (and their external
+    weight files) left behind by an earlier export in another mode are removed first, so the
+    directory only holds the decoders of the new export.
+    """
+    for name in DECODER_FILES + [EXPORT_MANIFEST]:
+        for path in (os.path.join(output_dir, name), os.path.join(output_dir, name + "_data")):
+            if os.path.exists(path):
+                os.remove(path)
+    for name in list_files(staging_dir):
+        target = os.path.join(output_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(os.path.join(staging_dir, name), target)
+
+def create_whisper_onnx(model_name="openai/whisper-base", output_dir="whisper_onnx", mode="merged", static_encoder=True, cache=None, force=False):
+    """
+    Converts a Whisper model (openai/whisper-base by default) to ONNX format using Hugging Face Optimum.
+    The decoder is exported with past key/values (see EXPORT_MODES) and, unless static_encoder is
+    False, the encoder input is pinned to the fixed 30 s / 3000-frame mel shape.
+    With an ArtifactCache, an identical earlier export is restored instead of re-exported.
+    Returns output_dir on success and None on failure.
+    """
+    if mode not in EXPORT_MODES:
+        raise ValueError(f"Unknown export mode: {mode}. Choose one of {', '.join(EXPORT_MODES)}")
+    task = EXPORT_MODES[mode]["task"]
 
     print(f"Starting ONNX export for model: {model_name}...")
     print(f"Output directory: {output_dir}")
-    print(f"Task: {task}")
+    print(f"Task: {task} ({mode} decoder)")
+
+    def export_to(export_dir):
+        # Imported here because it is slow and not needed when the cache already has the export
+        from optimum.exporters.onnx import main_export
 
-    try:
         main_export(
             model_name_or_path=model_name,
-            output=output_dir,
+            output=export_dir,
             task=task,
-            no_post_process=False, # Default, but explicit for clarity
+            no_post_process=EXPORT_MODES[mode]["no_post_process"], # Post-processing merges the with/without-past decoders
             trust_remote_code=False # Default, but explicit for security
             # Other parameters can be added if needed, e.g., opset, device
         )
+        prune_unused_decoders(export_dir, mode) # Before caching, so the cache entry stays small too
+        if static_encoder:
+            with open(os.path.join(export_dir, "config.json")) as f:
+                num_mel_bins = json.load(f)["num_mel_bins"]
+            pin_encoder_input_shape(os.path.join(export_dir, "encoder_model.onnx"), num_mel_bins)
+            print(f"Encoder input pinned to (batch_size, {num_mel_bins}, {ENCODER_FRAMES}).")
+        with open(os.path.join(export_dir, EXPORT_MANIFEST), "w") as f:
+            json.dump({"model": model_name, "mode": mode, "decoders": EXPORT_MODES[mode]["decoders"],
+                       "static_encoder": static_encoder}, f, indent=2)
+
+    try:
+        fingerprint = whisper_model_fingerprint(model_name) if cache is not None else None
+        if cache is not None and fingerprint is None:
+            print("Could not identify the model weights; exporting without the artifact cache.")
+            cache = None
+        description = {
+            "artifact": "whisper",
+            "model": model_name,
+            "weights": fingerprint,
+            "task": task,
+            "mode": mode,
+            "static_encoder": static_encoder,
+            "exporter": package_versions("optimum", "optimum-onnx", "transformers", "torch", "onnx"),
+            "converter": hash_files([os.path.abspath(__file__)]),
+        }
+        os.makedirs(output_dir, exist_ok=True)
+        # Exported (or restored) into a fresh staging directory: a failed export leaves output_dir
+        # untouched, and the cache entry holds exactly the files of this export
+        staging_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_dir)), prefix=".whisper-staging-")
+        try:
+            cached_export(cache, description, staging_dir, lambda: list_files(staging_dir), lambda: export_to(staging_dir), force)
+            install_export(staging_dir, output_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
         print(f"ONNX export completed successfully. Model saved in {output_dir}")
+        return output_dir
+    except ImportError:
+        print("Optimum library not found. Please install it with ONNX export support:")
+        print("pip install optimum[exporters]")
     except Exception as e:
         print(f"An error occurred during ONNX export: {e}")
         # For more detailed debugging, one might add:
         # import traceback
         # print(traceback.format_exc())
 
+# ------------------ Decoding with the exported model ------------------
+
+def log_softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+class WhisperOnnxModel:
+    """
+    Runs an exported Whisper directory with onnxruntime. The decoder keeps the self-attention
+    key/values of previous tokens and the cross-attention key/values of the first step, so each
+    generated token only feeds one new position through the decoder.
+    """
+    def __init__(self, model_dir="whisper_onnx", session_options=None, providers=("CPUExecutionProvider",), mode=None):
+        """
+        mode selects the decoder files (see EXPORT_MODES); by default it is read from the export
+        manifest. Directories exported before the manifest existed fall back to trying the
+        merged decoder, then the split pair, then the no-past decoder.
+        """
+        import onnxruntime as ort
+
+        def load(file_name):
+            path = os.path.join(model_dir, file_name)
+            if not os.path.exists(path):
+                return None
+            return ort.InferenceSession(path, sess_options=session_options, providers=list(providers))
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            self.config = json.load(f)
+        generation_config_path = os.path.join(model_dir, "generation_config.json")
+        self.generation_config = {}
+        if os.path.exists(generation_config_path):
+            with open(generation_config_path) as f:
+                self.generation_config = json.load(f)
+
+        manifest_path = os.path.join(model_dir, EXPORT_MANIFEST)
+        if mode is None and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                mode = json.load(f)["mode"]
+        if mode is not None and mode not in EXPORT_MODES:
+            raise ValueError(f"Unknown export mode: {mode}. Choose one of {', '.join(EXPORT_MODES)}")
+        self.mode = mode
+
+        self.encoder = load("encoder_model.onnx")
+        self.decoder_with_past = None
+        if mode is not None:
+            decoders = [load(name) for name in EXPORT_MODES[mode]["decoders"]]
+            if any(decoder is None for decoder in decoders):
+                raise FileNotFoundError(f"{model_dir} has no complete {mode} decoder ({', '.join(EXPORT_MODES[mode]['decoders'])}).")
+            self.decoder = decoders[0]
+            if len(decoders) > 1:
+                self.decoder_with_past = decoders[1]
+        else:
+            # Prefer the merged decoder, then the split pair, then the no-past decoder
+            self.decoder = load("decoder_model_merged.onnx")
+            if self.decoder is None:
+                self.decoder = load("decoder_model.onnx")
+                self.decoder_with_past = load("decoder_with_past_model.onnx")
+        if self.encoder is None or self.decoder is None:
+            raise FileNotFoundError(f"No Whisper ONNX encoder/decoder found in {model_dir}. Run convert_whisper_to_onnx.py first.")
+
+        self.decoder_inputs = {session: [i.name for i in session.get_inputs()] for session in (self.decoder, self.decoder_with_past) if session}
+        self.decoder_outputs = {session: [o.name for o in session.get_outputs()] for session in (self.decoder, self.decoder_with_past) if session}
+        self.uses_cache = any(name.startswith("past_key_values.") for names in self.decoder_inputs.values() for name in names)
+        self.num_heads = self.config["decoder_attention_heads"]
+        self.head_dim = self.config["d_model"] // self.num_heads
+        self.eos_token_id = self.generation_config.get("eos_token_id", self.config["eos_token_id"])
+        self.max_target_positions = self.config["max_target_positions"]
+
+    def default_prompt_ids(self):
+        # <|startoftranscript|> followed by any forced language/task/timestamp tokens
+        prompt = [self.generation_config.get("decoder_start_token_id", self.config["decoder_start_token_id"])]
+        forced_decoder_ids = self.generation_config.get("forced_decoder_ids") or self.config.get("forced_decoder_ids") or []
+        # A null token (usually the language) is left for the model to predict, which ends the forced prefix
+        for _, token in sorted(forced_decoder_ids, key=lambda forced: forced[0]):
+            if token is None:
+                break
+            prompt.append(token)
+        return prompt
+
+    def build_prompt_ids(self, language=None, task="transcribe", timestamps=False):
+        """
+        Builds the decoder prompt from the generation config: <|startoftranscript|>, the language
+        token (e.g. "en"), the task token and <|notimestamps|>. Without a language, or when the export
+        has no language/task vocabulary, this is default_prompt_ids() and the model detects the language.
+        """
+        lang_to_id = self.generation_config.get("lang_to_id")
+        task_to_id = self.generation_config.get("task_to_id")
+        if language is None or not lang_to_id or not task_to_id:
+            return self.default_prompt_ids()
+        prompt = [self.generation_config.get("decoder_start_token_id", self.config["decoder_start_token_id"])]
+        prompt.append(lang_to_id[f"<|{language}|>"])
+        prompt.append(task_to_id[task])
+        if not timestamps and "no_timestamps_token_id" in self.generation_config:
+            prompt.append(self.generation_config["no_timestamps_token_id"])
+        return prompt
+
+    def encode(self, input_features):
+        # input_features: (batch_size, num_mel_bins, 3000) -> (batch_size, 1500, d_model)
+        input_features = np.ascontiguousarray(input_features, dtype=np.float32)
+        return self.encoder.run(None, {"input_features": input_features})[0]
+
+    def decoder_step(self, input_ids, encoder_hidden_states, past=None):
+        """
+        Runs the decoder on input_ids (the new tokens only when past is given).
+        Returns (logits, past) with logits of shape (batch_size, len(input_ids[0]), vocab_size);
+        past is None for no-past exports.
+        """
+        session = self.decoder_with_past if past is not None and self.decoder_with_past is not None else self.decoder
+        input_names = self.decoder_inputs[session]
+        batch_size, new_tokens = input_ids.shape
+        past_length = 0
+        if past:
+            past_length = next(value for name, value in past.items() if ".decoder." in name).shape[2]
+
+        feeds = {"input_ids": np.ascontiguousarray(input_ids, dtype=np.int64)}
+        if "encoder_hidden_states" in input_names:
+            feeds["encoder_hidden_states"] = encoder_hidden_states
+        if "use_cache_branch" in input_names:
+            feeds["use_cache_branch"] = np.array([past is not None])
+        if "cache_position" in input_names:
+            feeds["cache_position"] = np.arange(past_length, past_length + new_tokens, dtype=np.int64)
+        empty_past = None
+        for name in input_names:
+            if not name.startswith("past_key_values."):
+                continue
+            if past is not None:
+                feeds[name] = past[name]
+            else:
+                # The merged decoder still expects past inputs on its first step, with zero length
+                if empty_past is None:
+                    empty_past = np.zeros((batch_size, self.num_heads, 0, self.head_dim), dtype=np.float32)
+                feeds[name] = empty_past
+
+        outputs = dict(zip(self.decoder_outputs[session], session.run(None, feeds)))
+        if not self.uses_cache:
+            return outputs["logits"], None
+        next_past = dict(past) if past is not None else {}
+        for name, value in outputs.items():
+            if not name.startswith("present."):
+                continue
+            past_name = "past_key_values." + name[len("present."):]
+            # Cross-attention key/values only depend on the audio, so the first step's are kept
+            if past is not None and ".encoder." in past_name:
+                continue
+            next_past[past_name] = value
+        return outputs["logits"], next_past
+
+    def max_new_tokens_for(self, prompt_length, max_new_tokens):
+        return min(max_new_tokens, self.max_target_positions - prompt_length)
+
+    def greedy_decode(self, input_features, prompt_ids=None, max_new_tokens=224):
+        """Greedy decoding. Returns one list of generated token ids (without prompt and EOS) per input."""
+        encoder_hidden_states = self.encode(input_features)
+        batch_size = encoder_hidden_states.shape[0]
+        prompt = np.array(prompt_ids or self.default_prompt_ids(), dtype=np.int64)
+        tokens = np.tile(prompt, (batch_size, 1))
+        finished = np.zeros(batch_size, dtype=bool)
+
+        input_ids, past = tokens, None
+        for _ in range(self.max_new_tokens_for(len(prompt), max_new_tokens)):
+            logits, past = self.decoder_step(input_ids, encoder_hidden_states, past)
+            next_tokens = np.where(finished, self.eos_token_id, logits[:, -1].argmax(axis=-1))
+            tokens = np.concatenate([tokens, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+            # With a cache only the new token is fed; otherwise the whole prefix is re-run
+            input_ids = next_tokens[:, None] if self.uses_cache else tokens
+
+        return [self.strip_generated(row[len(prompt):]) for row in tokens]
+
+    def beam_search(self, input_features, num_beams=5, prompt_ids=None, max_new_tokens=224, length_penalty=1.0):
+        """Beam search decoding. Returns the best list of generated token ids per input."""
+        encoder_hidden_states = np.repeat(self.encode(input_features), num_beams, axis=0)
+        batch_size = encoder_hidden_states.shape[0] // num_beams
+        prompt = np.array(prompt_ids or self.default_prompt_ids(), dtype=np.int64)
+        tokens = np.tile(prompt, (batch_size * num_beams, 1))
+        # Only the first beam of each input is live at the start, so the beams do not duplicate
+        beam_scores = np.full((batch_size, num_beams), -np.inf, dtype=np.float32)
+        beam_scores[:, 0] = 0.0
+        hypotheses = [[] for _ in range(batch_size)] # (score, token ids) of finished beams
+        done = np.zeros(batch_size, dtype=bool)
+
+        input_ids, past = tokens, None
+        for step in range(self.max_new_tokens_for(len(prompt), max_new_tokens)):
+            logits, past = self.decoder_step(input_ids, encoder_hidden_states, past)
+            log_probs = log_softmax(logits[:, -1].astype(np.float32))
+            vocab_size = log_probs.shape[-1]
+            candidate_scores = (beam_scores.reshape(-1, 1) + log_probs).reshape(batch_size, num_beams * vocab_size)
+            # Top 2 * num_beams candidates per input leave room to drop EOS continuations
+            top = np.argsort(-candidate_scores, axis=1)[:, :2 * num_beams]
+
+            beam_index = np.zeros((batch_size, num_beams), dtype=np.int64)
+            next_tokens = np.full((batch_size, num_beams), self.eos_token_id, dtype=np.int64)
+            next_scores = np.full((batch_size, num_beams), -np.inf, dtype=np.float32)
+            for row in range(batch_size):
+                beam_index[row] = row * num_beams
+                if done[row]:
+                    continue
+                kept = 0
+                for rank, candidate in enumerate(top[row]):
+                    score = candidate_scores[row, candidate]
+                    source_beam, token = divmod(int(candidate), vocab_size)
+                    if token == self.eos_token_id:
+                        if rank >= num_beams:
+                            continue
+                        generated = tokens[row * num_beams + source_beam, len(prompt):]
+                        hypotheses[row].append((score / max(len(generated) + 1, 1) ** length_penalty, generated))
+                        continue
+                    beam_index[row, kept] = row * num_beams + source_beam
+                    next_tokens[row, kept] = token
+                    next_scores[row, kept] = score
+                    kept += 1
+                    if kept == num_beams:
+                        break
+                if len(hypotheses[row]) >= num_beams:
+                    done[row] = True
+            if done.all():
+                break
+
+            flat_index = beam_index.reshape(-1)
+            tokens = np.concatenate([tokens[flat_index], next_tokens.reshape(-1, 1)], axis=1)
+            beam_scores = next_scores
+            if past is not None:
+                # Beams only move within their own input, whose cross-attention key/values are identical
+                past = {name: value if ".encoder." in name else value[flat_index] for name, value in past.items()}
+            input_ids = next_tokens.reshape(-1, 1) if self.uses_cache else tokens
+
+        best = []
+        for row in range(batch_size):
+            candidates = list(hypotheses[row])
+            if not done[row]:
+                for beam in range(num_beams):
+                    if np.isfinite(beam_scores[row, beam]):
+                        generated = tokens[row * num_beams + beam, len(prompt):]
+                        candidates.append((beam_scores[row, beam] / max(len(generated), 1) ** length_penalty, generated))
+            best.append(self.strip_generated(max(candidates, key=lambda candidate: candidate[0])[1]))
+        return best
+
+    def strip_generated(self, generated):
+        generated = [int(token) for token in generated]
+        if self.eos_token_id in generated:
+            generated = generated[:generated.index(self.eos_token_id)]
+        return generated
+
 if __name__ == "__main__":
-    create_whisper_onnx()
+    import argparse
+    parser = argparse.ArgumentParser(description="Export Whisper to ONNX")
+    parser.add_argument("--model", default="openai/whisper-base", help="Hugging Face model name or local path")
+    parser.add_argument("--output", default="whisper_onnx", help="Directory to save the ONNX model files")
+    parser.add_argument("--mode", default="merged", choices=list(EXPORT_MODES), help="Decoder export mode")
+    parser.add_argument("--dynamic-encoder", action="store_true", help="Keep the encoder input shape dynamic")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Artifact cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Always export without touching the cache")
+    parser.add_argument("--force", action="store_true", help="Re-export even if the cache has a matching artifact")
+    args = parser.parse_args()
+    cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+    if create_whisper_onnx(args.model, args.output, args.mode, static_encoder=not args.dynamic_encoder, cache=cache, force=args.force) is None:
+        sys.exit(1)
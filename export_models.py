@@ -0,0 +1,218 @@
+# export_models.py
+"""
+Exports the whole model set (Whisper checkpoints and SEGBOT configurations) concurrently.
+
+Every export runs as its own converter subprocess, so a crash or an out-of-memory kill only fails
+that job. Jobs are started largest-first whenever a worker slot is free and their estimated peak
+memory fits in the remaining budget, which keeps big exports from running at the same time while
+small ones fill the gaps; wall-clock time stays close to the slowest single export. When all jobs
+are done an index.json describing every artifact is written for the frontend.
+
+Usage:
+    python export_models.py --output-dir models
+    python export_models.py --matrix models.json --jobs 4 --memory-budget-gb 24
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Mirrors the checkpoints the frontend Whisper worker can select
+DEFAULT_MATRIX = {
+    "whisper": [
+        {"model": "openai/whisper-tiny"},
+        {"model": "openai/whisper-tiny.en"},
+        {"model": "openai/whisper-base"},
+        {"model": "openai/whisper-base.en"},
+        {"model": "openai/whisper-small"},
+        {"model": "openai/whisper-small.en"},
+        {"model": "openai/whisper-medium"},
+        {"model": "openai/whisper-medium.en"},
+        {"model": "distil-whisper/distil-medium.en"},
+        {"model": "distil-whisper/distil-large-v2"},
+    ],
+    "segbot": [
+        {"input_dim": 128, "hidden_dim": 256},
+    ],
+}
+
+# Rough peak RSS of an export in GB, matched against the model name
+WHISPER_MEMORY_GB = [("tiny", 1.5), ("base", 2), ("small", 4), ("medium", 10), ("large", 20)]
+DEFAULT_WHISPER_MEMORY_GB = 8
+SEGBOT_MEMORY_GB = 1
+
+def total_memory_gb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return 8 # sysconf is unavailable on Windows
+
+def whisper_memory_gb(model_name):
+    name = model_name.lower()
+    for size, memory_gb in WHISPER_MEMORY_GB:
+        if size in name:
+            return memory_gb
+    return DEFAULT_WHISPER_MEMORY_GB
+
+def build_jobs(matrix, output_dir, cache_args):
+    """Turns the matrix into converter command lines with an output directory and memory estimate each."""
+    jobs = []
+    for entry in matrix.get("whisper", []):
+        model_name = entry["model"]
+        mode = entry.get("mode", "merged")
+        job_id = f"whisper/{model_name.replace('/', '__')}"
+        job_output = os.path.join(output_dir, job_id)
+        jobs.append({
+            "id": job_id,
+            "type": "whisper",
+            "model": model_name,
+            "mode": mode,
+            "output": job_output,
+            "memory_gb": entry.get("memory_gb", whisper_memory_gb(model_name)),
+            "command": [sys.executable, os.path.join(ROOT_DIR, "convert_whisper_to_onnx.py"),
+                        "--model", model_name, "--output", job_output, "--mode", mode, *cache_args],
+        })
+    for entry in matrix.get("segbot", []):
+        input_dim, hidden_dim = entry["input_dim"], entry["hidden_dim"]
+        job_id = f"segbot/segbot-{input_dim}x{hidden_dim}"
+        job_output = os.path.join(output_dir, job_id)
+        command = [sys.executable, os.path.join(ROOT_DIR, "convert_segbot_to_onnx.py"),
+                   "--input-dim", str(input_dim), "--hidden-dim", str(hidden_dim), "--output-dir", job_output, *cache_args]
+        if "checkpoint" in entry:
+            command += ["--checkpoint", entry["checkpoint"]]
+        if "variants" in entry:
+            command += ["--variants", *entry["variants"]]
+        jobs.append({
+            "id": job_id,
+            "type": "segbot",
+            "model": "segbot",
+            "config": {"input_dim": input_dim, "hidden_dim": hidden_dim},
+            "output": job_output,
+            "memory_gb": entry.get("memory_gb", SEGBOT_MEMORY_GB),
+            "command": command,
+        })
+    return jobs
+
+def run_jobs(jobs, max_workers, memory_budget_gb, log_dir):
+    """
+    Runs jobs as subprocesses, at most max_workers at a time and within memory_budget_gb of
+    estimated memory. A job larger than the whole budget still runs, but only on its own.
+    Returns one result dict per job.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    pending = sorted(jobs, key=lambda job: job["memory_gb"], reverse=True)
+    running = []
+    results = {}
+    # Split the cores between concurrent exports instead of letting each grab all of them
+    threads_per_job = str(max(1, (os.cpu_count() or 1) // max_workers))
+
+    while pending or running:
+        memory_in_use = sum(job["memory_gb"] for job, _, _, _ in running)
+        for job in list(pending):
+            if len(running) >= max_workers:
+                break
+            fits = memory_in_use + job["memory_gb"] <= memory_budget_gb
+            if not fits and running:
+                continue
+            log_path = os.path.join(log_dir, job["id"].replace("/", "__") + ".log")
+            log_file = open(log_path, "w")
+            env = dict(os.environ, OMP_NUM_THREADS=threads_per_job, MKL_NUM_THREADS=threads_per_job)
+            process = subprocess.Popen(job["command"], stdout=log_file, stderr=subprocess.STDOUT, env=env, cwd=ROOT_DIR)
+            running.append((job, process, log_file, time.perf_counter()))
+            pending.remove(job)
+            memory_in_use += job["memory_gb"]
+            print(f"Started {job['id']} (~{job['memory_gb']} GB, log: {log_path})")
+
+        time.sleep(0.2)
+        for entry in list(running):
+            job, process, log_file, started = entry
+            if process.poll() is None:
+                continue
+            running.remove(entry)
+            log_file.close()
+            elapsed = time.perf_counter() - started
+            ok = process.returncode == 0
+            result = {"status": "ok" if ok else "failed", "elapsed_seconds": round(elapsed, 1), "log": log_file.name}
+            if not ok:
+                with open(log_file.name) as f:
+                    result["error"] = "".join(f.readlines()[-20:])
+            results[job["id"]] = result
+            print(f"{'Finished' if ok else 'FAILED'} {job['id']} in {elapsed:.1f}s")
+    return [results[job["id"]] for job in jobs]
+
+def describe_files(directory):
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files.append({"name": os.path.relpath(path, directory).replace(os.sep, "/"), "size_bytes": os.path.getsize(path)})
+    return files
+
+def write_index(jobs, results, output_dir):
+    models = []
+    for job, result in zip(jobs, results):
+        entry = {
+            "id": job["id"],
+            "type": job["type"],
+            "model": job["model"],
+            "path": os.path.relpath(job["output"], output_dir).replace(os.sep, "/"),
+            **({"mode": job["mode"]} if "mode" in job else {}),
+            **({"config": job["config"]} if "config" in job else {}),
+            "status": result["status"],
+            "elapsed_seconds": result["elapsed_seconds"],
+        }
+        if result["status"] == "ok":
+            entry["files"] = describe_files(job["output"])
+            entry["size_bytes"] = sum(f["size_bytes"] for f in entry["files"])
+        else:
+            entry["error"] = result.get("error", "")
+        models.append(entry)
+
+    index_path = os.path.join(output_dir, "index.json")
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"generated": time.strftime("%Y-%m-%dT%H:%M:%S"), "models": models}, f, indent=2)
+    os.replace(temp_path, index_path)
+    return index_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Whisper and SEGBOT model set in parallel")
+    parser.add_argument("--matrix", help="JSON file with 'whisper' and 'segbot' job lists (default: the built-in set)")
+    parser.add_argument("--output-dir", default="models")
+    parser.add_argument("--jobs", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Maximum concurrent exports")
+    parser.add_argument("--memory-budget-gb", type=float, default=round(total_memory_gb() * 0.75, 1),
+                        help="Estimated memory all running exports may use together")
+    parser.add_argument("--only", nargs="+", help="Run only jobs whose id contains one of these strings")
+    parser.add_argument("--cache-dir", help="Artifact cache directory passed to the converters")
+    parser.add_argument("--force", action="store_true", help="Re-export even if the cache has a matching artifact")
+    args = parser.parse_args()
+
+    matrix = DEFAULT_MATRIX
+    if args.matrix:
+        with open(args.matrix) as f:
+            matrix = json.load(f)
+    cache_args = (["--cache-dir", args.cache_dir] if args.cache_dir else []) + (["--force"] if args.force else [])
+    output_dir = os.path.abspath(args.output_dir)
+    jobs = build_jobs(matrix, output_dir, cache_args)
+    if args.only:
+        jobs = [job for job in jobs if any(pattern in job["id"] for pattern in args.only)]
+    if not jobs:
+        print("No export jobs selected.")
+        return
+
+    print(f"Running {len(jobs)} export job(s) with {args.jobs} worker(s) and a {args.memory_budget_gb} GB memory budget...")
+    start = time.perf_counter()
+    results = run_jobs(jobs, args.jobs, args.memory_budget_gb, os.path.join(output_dir, "logs"))
+    index_path = write_index(jobs, results, output_dir)
+    failed = [job["id"] for job, result in zip(jobs, results) if result["status"] != "ok"]
+    print(f"All exports finished in {time.perf_counter() - start:.1f}s. Index written to {index_path}")
+    if failed:
+        print(f"{len(failed)} export(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
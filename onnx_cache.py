@@ -0,0 +1,168 @@
+# onnx_cache.py
+"""
+Content-addressed cache for ONNX conversion artifacts.
+
+Each entry is keyed by a SHA-256 over a JSON description of everything that determines the
+export (model weights/config hash, opset, dynamic axes, quantization mode, exporter and converter
+versions). Entries live in <cache_dir>/<key>/ next to a manifest.json that records what each
+artifact is, its size and when it was last used; the least recently used entries are evicted
+once the cache grows past its size budget.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows: manifest updates are not locked
+
+DEFAULT_CACHE_DIR = os.environ.get("VIBE_ONNX_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "vibe", "onnx"))
+DEFAULT_MAX_BYTES = int(float(os.environ.get("VIBE_ONNX_CACHE_MAX_GB", "20")) * 1024 ** 3)
+MANIFEST_FILE = "manifest.json"
+
+def hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest
+
+def hash_files(paths):
+    # Order-independent hash over file names and contents
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        hash_file(path, digest)
+    return digest.hexdigest()
+
+def hash_state_dict(state_dict):
+    """Hash of a torch state_dict: parameter names, shapes, dtypes and values."""
+    digest = hashlib.sha256()
+    for name in sorted(state_dict):
+        tensor = state_dict[name].detach().cpu().contiguous()
+        digest.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode())
+        digest.update(tensor.numpy().tobytes())
+    return digest.hexdigest()
+
+def cache_key(description):
+    canonical = json.dumps(description, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ArtifactCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.cache_dir, MANIFEST_FILE)
+
+    @contextmanager
+    def locked(self):
+        # Serializes manifest read-modify-write cycles between concurrent export processes
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except ValueError:
+            return {} # A corrupt manifest only costs a rebuild
+
+    def save_manifest(self, manifest):
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".manifest-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def restore(self, key, destination):
+        """
+        Copies the files of a cached entry into destination (a directory) and marks the entry as
+        recently used. Returns False on a miss.
+        """
+        with self.locked():
+            manifest = self.load_manifest()
+            entry = manifest.get(key)
+            entry_dir = os.path.join(self.cache_dir, key)
+            if entry is None or not all(os.path.exists(os.path.join(entry_dir, name)) for name in entry["files"]):
+                return False
+            for name in entry["files"]:
+                target = os.path.join(destination, name)
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                # Copies rather than hard links, so a later export writing to target cannot corrupt the cache
+                shutil.copy2(os.path.join(entry_dir, name), target)
+            entry["last_used"] = time.time()
+            self.save_manifest(manifest)
+            return True
+
+    def store(self, key, source_dir, files, description):
+        """Adds files (paths relative to source_dir) to the cache under key, then evicts down to max_bytes."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        staging_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".staging-")
+        size = 0
+        for name in files:
+            target = os.path.join(staging_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(source_dir, name), target)
+            size += os.path.getsize(target)
+        with self.locked():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(staging_dir, entry_dir)
+
+            manifest = self.load_manifest()
+            now = time.time()
+            manifest[key] = {
+                "description": description,
+                "files": sorted(files),
+                "size_bytes": size,
+                "created": now,
+                "last_used": now,
+            }
+            self.evict(manifest, keep=key)
+            self.save_manifest(manifest)
+
+    def evict(self, manifest, keep=None):
+        # Least recently used first, never the entry that was just stored
+        total = sum(entry["size_bytes"] for entry in manifest.values())
+        for key in sorted(manifest, key=lambda key: manifest[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= manifest[key]["size_bytes"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            del manifest[key]
+
+def cached_export(cache, description, output_dir, files, export, force=False):
+    """
+    Restores files into output_dir from the cache when an entry matches description; otherwise
+    runs export() (which must write files into output_dir) and stores the result.
+    files is a list of paths relative to output_dir, or a callable returning it after export.
+    Returns True on a cache hit.
+    """
+    if cache is None:
+        export()
+        return False
+    key = cache_key(description)
+    if not force and cache.restore(key, output_dir):
+        print(f"Restored {description.get('artifact', 'artifact')} from cache ({key[:12]}).")
+        return True
+    export()
+    cache.store(key, output_dir, files() if callable(files) else files, description)
+    return False
@@ -0,0 +1,167 @@
+# segbot_processing.py
+"""
+Batched NumPy pre- and post-processing around SEGBOT inference.
+
+Features: recordings are turned into (units, 128) log-mel unit features (10 ms frames mean-pooled
+into 0.5 s units and normalised per recording), and feature sequences are packed into the
+zero-padded input_x / lengths feeds the exported models take. Every array handed to ONNX Runtime
+is C-contiguous float32 / int64, so session.run() uses it in place instead of copying it.
+
+Boundaries: the pointer's softmax outputs for a whole batch are turned into segment boundaries
+(local peaks above an absolute and/or relative threshold, at least min_gap units apart) with
+whole-batch array operations, so the cost does not grow with Python work per row.
+"""
+import numpy as np
+
+from transcribe_whisper_onnx import HOP_LENGTH, N_FFT, SAMPLE_RATE, mel_filter_bank
+
+SEGBOT_INPUT_DIM = 128
+UNIT_FRAMES = 50 # 10 ms hops -> 0.5 s units
+BLOCK_UNITS = 120 # Units per STFT block (60 s), bounds the memory of long recordings
+
+# ------------------ Features ------------------
+
+def log_mel_frames(audio, mel_filters):
+    """16 kHz mono float32 audio (samples,) -> (frames, n_mels) float32 log-mel frames at HOP_LENGTH."""
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)).astype(np.float32) # Periodic Hann
+    n_frames = len(audio) // HOP_LENGTH
+    # Reflect padding needs more samples than the pad width; very short inputs are zero padded
+    padded = np.pad(audio, N_FFT // 2, mode="reflect" if len(audio) > N_FFT // 2 else "constant")
+    frames = np.lib.stride_tricks.sliding_window_view(padded, N_FFT)[::HOP_LENGTH][:n_frames]
+    log_mel = np.empty((n_frames, mel_filters.shape[0]), dtype=np.float32)
+    block = BLOCK_UNITS * UNIT_FRAMES
+    for begin in range(0, n_frames, block):
+        spectrum = np.fft.rfft(frames[begin:begin + block] * window, axis=-1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32)
+        np.log10(np.maximum(power @ mel_filters.T, 1e-10), out=log_mel[begin:begin + block])
+    return log_mel
+
+def audio_unit_features(audio, mel_filters=None, unit_frames=UNIT_FRAMES):
+    """
+    SEGBOT input features for one recording: (units, n_mels) float32, C-contiguous.
+    audio is 16 kHz mono float32 (see transcribe_whisper_onnx.to_mono_float); log-mel frames are
+    mean-pooled into units of unit_frames frames (a shorter last unit is kept) and each mel bin is
+    normalised to zero mean and unit variance over the recording.
+    """
+    if mel_filters is None:
+        mel_filters = mel_filter_bank(SEGBOT_INPUT_DIM)
+    frames = log_mel_frames(np.asarray(audio, dtype=np.float32), mel_filters)
+    if len(frames) == 0:
+        return np.zeros((0, mel_filters.shape[0]), dtype=np.float32)
+    full_units, remainder = divmod(len(frames), unit_frames)
+    units = frames[:full_units * unit_frames].reshape(full_units, unit_frames, -1).mean(axis=1)
+    if remainder:
+        units = np.concatenate([units, frames[full_units * unit_frames:].mean(axis=0, keepdims=True)])
+    units -= units.mean(axis=0)
+    units /= units.std(axis=0) + 1e-5
+    return np.ascontiguousarray(units, dtype=np.float32)
+
+def pad_sequences(sequences):
+    """
+    Stacks (seq_len_i, input_dim) feature arrays into one zero-padded float32 batch.
+    Returns (input_x, lengths) with shapes (batch_size, max_len, input_dim) and (batch_size,).
+    """
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    input_dim = sequences[0].shape[1]
+    input_x = np.zeros((len(sequences), int(lengths.max()), input_dim), dtype=np.float32)
+    for row, sequence in enumerate(sequences):
+        input_x[row, :len(sequence)] = sequence # One memcpy per row; faster than concatenating first
+    return input_x, lengths
+
+def pack_features(flat_features, lengths):
+    """
+    Same result as pad_sequences() for features that are already concatenated into one
+    (sum(lengths), input_dim) array, scattered into the padded batch with a single copy.
+    """
+    lengths = np.ascontiguousarray(lengths, dtype=np.int64)
+    flat_features = np.asarray(flat_features, dtype=np.float32)
+    if len(flat_features) != lengths.sum():
+        raise ValueError(f"lengths add up to {lengths.sum()} units but {len(flat_features)} were given")
+    valid = np.arange(int(lengths.max())) < lengths[:, np.newaxis]
+    input_x = np.zeros(valid.shape + (flat_features.shape[1],), dtype=np.float32)
+    input_x[valid] = flat_features
+    return input_x, lengths
+
+def build_audio_batch(recordings, mel_filters=None, unit_frames=UNIT_FRAMES):
+    """Features for several recordings as (input_x, lengths) feeds; see audio_unit_features()."""
+    if mel_filters is None:
+        mel_filters = mel_filter_bank(SEGBOT_INPUT_DIM)
+    return pad_sequences([audio_unit_features(audio, mel_filters, unit_frames) for audio in recordings])
+
+def unit_times(boundaries, unit_frames=UNIT_FRAMES):
+    # Unit index -> end time in seconds of that unit
+    return (np.asarray(boundaries) + 1) * unit_frames * HOP_LENGTH / SAMPLE_RATE
+
+# ------------------ Boundaries ------------------
+
+def window_max(values, width):
+    """
+    values[:, i:i + width].max(axis=1) for every i, with -inf past the end of a row.
+    Uses O(log width) whole-array passes instead of a loop over positions.
+    """
+    result = values.copy()
+    span = 1
+    while span < width:
+        step = min(span, width - span)
+        # result[:, i] covers [i, i + span); combining with result[:, i + step] covers [i, i + span + step)
+        result[:, :-step] = np.maximum(result[:, :-step], result[:, step:])
+        span += step
+    return result
+
+def extract_boundaries(attention_weights, lengths=None, threshold=0.0, relative_threshold=0.0, min_gap=1, include_last=True,
+                       start_units=None):
+    """
+    Picks segment boundaries from the pointer's softmax outputs for a whole batch at once.
+
+    attention_weights: (batch_size, seq_len, 1) or (batch_size, seq_len); lengths (optional) gives
+    the number of real units per row, and padding positions are never picked. start_units
+    (optional) masks the units before each row's segment start, as SEGBOT.decode_step() does.
+    A unit is a candidate if it is a local peak (above its left neighbour and at least its right
+    one), its weight is >= threshold and >= relative_threshold * the row maximum. A candidate is
+    kept if no stronger candidate lies fewer than min_gap units away (the earlier one wins ties).
+    With include_last the last unit of each row is always a boundary, as in SEGBOT.segment(), and
+    candidates closer than min_gap to it are dropped.
+
+    Returns (rows, positions, scores) flat arrays ordered by row and then position;
+    split_boundaries() turns them into one list per row.
+    """
+    scores = np.asarray(attention_weights, dtype=np.float32)
+    if scores.ndim == 3:
+        scores = scores[..., 0]
+    batch_size, seq_len = scores.shape
+    positions = np.arange(seq_len)
+    if lengths is None:
+        lengths = np.full(batch_size, seq_len, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    valid = positions < lengths[:, np.newaxis]
+    if start_units is not None:
+        valid &= positions >= np.asarray(start_units)[:, np.newaxis]
+    scores = np.where(valid, scores, -np.inf)
+
+    minus_inf = np.full((batch_size, 1), -np.inf, dtype=np.float32)
+    left = np.concatenate([minus_inf, scores[:, :-1]], axis=1)
+    right = np.concatenate([scores[:, 1:], minus_inf], axis=1)
+    candidates = valid & (scores > left) & (scores >= right) & (scores >= threshold)
+    if relative_threshold > 0:
+        candidates &= scores >= relative_threshold * scores.max(axis=1, keepdims=True)
+
+    reach = min_gap - 1 # Candidates closer than min_gap suppress each other
+    if reach > 0:
+        candidate_scores = np.where(candidates, scores, -np.inf)
+        # Strongest candidate in (i, i + reach] and in [i - reach, i)
+        after = np.concatenate([window_max(candidate_scores, reach)[:, 1:], minus_inf], axis=1)
+        before = np.concatenate([minus_inf, window_max(candidate_scores[:, ::-1], reach)[:, ::-1][:, :-1]], axis=1)
+        candidates &= (candidate_scores >= after) & (candidate_scores > before)
+
+    if include_last:
+        candidates &= positions <= (lengths - 1 - min_gap)[:, np.newaxis]
+        has_units = lengths > 0
+        candidates[np.flatnonzero(has_units), lengths[has_units] - 1] = True
+
+    rows, picked = np.nonzero(candidates)
+    return rows, picked, scores[rows, picked]
+
+def split_boundaries(rows, positions, batch_size):
+    """Flat (rows, positions) from extract_boundaries() -> one list of boundary indices per row."""
+    counts = np.bincount(rows, minlength=batch_size)
+    return [row.tolist() for row in np.split(positions, np.cumsum(counts)[:-1])]
@@ -0,0 +1,389 @@
+# serve_segbot_onnx.py
+"""
+Local HTTP inference service for the SEGBOT export written by convert_segbot_to_onnx.py.
+
+segbot.onnx is loaded once into a small pool of ONNX Runtime sessions. Incoming requests are put
+on an asyncio queue and a batcher gathers them into dynamic micro-batches: it waits for a free
+session, then takes requests until the batch is full or the oldest request has waited max_wait_ms.
+Under light load a request runs almost alone; under heavy load the queue builds up while every
+session is busy, so batches grow and throughput scales with load instead of paying one session
+run per request. Latency, batch-size and queue-depth metrics are served as JSON on /metrics.
+"boundary" is the pointer's top unit; "boundaries" are the peaks picked for the whole batch at
+once by segbot_processing.extract_boundaries() with the --threshold / --min-gap settings.
+
+Endpoints:
+    POST /segment   {"features": [[...input_dim floats...], ...], "start_unit": 0}
+                    -> {"boundary": 17, "boundaries": [17, 42, 63], "attention_weights": [...]}
+    GET  /metrics   latency percentiles, batch-size histogram, queue depth
+    GET  /healthz   "ok" once the sessions are loaded
+
+Usage:
+    python serve_segbot_onnx.py --model segbot.onnx --sessions 2 --max-batch-size 32 --max-wait-ms 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from segbot_processing import extract_boundaries, pad_sequences, split_boundaries
+
+LATENCY_WINDOW = 2048 # Requests kept for the latency percentiles
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def make_session(path, intra_op_threads):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+def pad_batch(items):
+    """Stacks the features of a batch into zero-padded input_x / start_units / lengths feeds."""
+    input_x, lengths = pad_sequences([item["features"] for item in items])
+    start_units = np.array([item["start_unit"] for item in items], dtype=np.int64)
+    return {"input_x": input_x, "start_units": start_units, "lengths": lengths}
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.padding_fraction_sum = 0.0
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW) # Enqueue -> result
+        self.queue_waits_ms = deque(maxlen=LATENCY_WINDOW) # Enqueue -> batch start
+        self.inference_ms = deque(maxlen=LATENCY_WINDOW) # One session run per batch
+        self.max_queue_depth = 0
+
+    def record_batch(self, items, lengths, inference_ms, finished):
+        self.batches += 1
+        self.batch_sizes[len(items)] += 1
+        self.padding_fraction_sum += 1 - lengths.sum() / (len(lengths) * lengths.max())
+        self.inference_ms.append(inference_ms)
+        for item in items:
+            self.requests += 1
+            self.queue_waits_ms.append((item["batch_start"] - item["enqueued"]) * 1000)
+            self.latencies_ms.append((finished - item["enqueued"]) * 1000)
+
+    @staticmethod
+    def percentiles(values):
+        if not values:
+            return None
+        values = np.fromiter(values, dtype=np.float64)
+        return {f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+    def snapshot(self, queue_depth, sessions, busy_sessions):
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else None,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "mean_padding_fraction": round(self.padding_fraction_sum / self.batches, 3) if self.batches else None,
+            "latency_ms": self.percentiles(self.latencies_ms),
+            "queue_wait_ms": self.percentiles(self.queue_waits_ms),
+            "inference_ms": self.percentiles(self.inference_ms),
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "sessions": sessions,
+            "busy_sessions": busy_sessions,
+        }
+
+class MicroBatcher:
+    """
+    Collects segment() calls into batches and runs them on a pool of ORT sessions.
+    Each session is used by at most one batch at a time; session.run() executes on a worker
+    thread, so the event loop keeps accepting requests while batches are in flight.
+    """
+    def __init__(self, model_path, num_sessions=2, max_batch_size=32, max_wait_ms=5.0, max_batch_tokens=None,
+                 max_queue_depth=1024, intra_op_threads=None, boundary_options=None):
+        if intra_op_threads is None:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // num_sessions) # Split the cores between sessions
+        self.sessions = [make_session(model_path, intra_op_threads) for _ in range(num_sessions)]
+        shape = self.sessions[0].get_inputs()[0].shape # (batch_size, sequence_length, input_dim)
+        self.input_dim = shape[2] if isinstance(shape[2], int) else None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_tokens = max_batch_tokens
+        self.max_queue_depth = max_queue_depth
+        self.boundary_options = boundary_options or {} # Keyword arguments for extract_boundaries()
+        self.executor = ThreadPoolExecutor(max_workers=num_sessions, thread_name_prefix="segbot-session")
+        self.metrics = Metrics()
+        self.queue = None
+        self.idle_sessions = None
+        self.batcher = None
+        self.tasks = set()
+        self.busy_sessions = 0 # Sessions with a session.run() in flight
+        self.carry = None # Request that did not fit into the previous batch
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.idle_sessions = asyncio.Queue()
+        for session in self.sessions:
+            self.idle_sessions.put_nowait(session)
+        self.batcher = asyncio.ensure_future(self.run_batches())
+
+    async def stop(self):
+        self.batcher.cancel()
+        for task in list(self.tasks):
+            await task
+        self.executor.shutdown(wait=True)
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize() + (self.carry is not None)
+
+    async def segment(self, features, start_unit=0):
+        """Scores one (seq_len, input_dim) sequence; returns (attention weights over seq_len, boundaries)."""
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim != 2 or len(features) == 0:
+            raise RequestError(400, "features must be a non-empty (seq_len, input_dim) array")
+        if self.input_dim is not None and features.shape[1] != self.input_dim:
+            raise RequestError(400, f"expected {self.input_dim} features per unit, got {features.shape[1]}")
+        if not 0 <= start_unit < len(features):
+            raise RequestError(400, f"start_unit must be in [0, {len(features)})")
+        if self.queue_depth >= self.max_queue_depth:
+            self.metrics.rejected += 1
+            raise RequestError(503, "queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait({"features": features, "start_unit": start_unit, "future": future, "enqueued": time.perf_counter()})
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue_depth)
+        return await future
+
+    def fits(self, batch, item):
+        if self.max_batch_tokens is None or not batch:
+            return True
+        longest = max(len(item["features"]), max(len(queued["features"]) for queued in batch))
+        return (len(batch) + 1) * longest <= self.max_batch_tokens
+
+    async def next_item(self, timeout=None):
+        if self.carry is not None:
+            item, self.carry = self.carry, None
+            return item
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def gather_batch(self):
+        # Block for the first request, then top up until the batch is full or the oldest request's wait runs out
+        batch = [await self.next_item()]
+        deadline = batch[0]["enqueued"] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if self.carry is None and not self.queue.empty():
+                item = self.queue.get_nowait()
+            else:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await self.next_item(remaining)
+                except asyncio.TimeoutError:
+                    break
+            if not self.fits(batch, item):
+                self.carry = item
+                break
+            batch.append(item)
+        return batch
+
+    async def run_batches(self):
+        while True:
+            # Waiting for a session before gathering lets the queue fill up while all sessions are busy
+            session = await self.idle_sessions.get()
+            batch = await self.gather_batch()
+            task = asyncio.ensure_future(self.run_batch(session, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, session, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                feeds = pad_batch(batch)
+                batch_start = time.perf_counter()
+                for item in batch:
+                    item["batch_start"] = batch_start
+                self.busy_sessions += 1
+                try:
+                    attention_weights = await loop.run_in_executor(self.executor, session.run, None, feeds)
+                finally:
+                    self.busy_sessions -= 1
+                finished = time.perf_counter()
+            finally:
+                # Released before post-processing so the next batch can start right away
+                self.idle_sessions.put_nowait(session)
+
+            weights = attention_weights[0][..., 0]
+            lengths = feeds["lengths"]
+            rows, positions, _ = extract_boundaries(weights, lengths, start_units=feeds["start_units"], **self.boundary_options)
+            boundaries = split_boundaries(rows, positions, len(batch))
+            self.metrics.record_batch(batch, lengths, (finished - batch_start) * 1000, finished)
+            results = [(weights[row, :lengths[row]], boundaries[row]) for row in range(len(batch))]
+        except Exception as e:
+            # Every request of the batch gets an answer, whatever step failed
+            for item in batch:
+                if not item["future"].done():
+                    item["future"].set_exception(RequestError(500, f"inference failed: {e}"))
+            return
+        for item, result in zip(batch, results):
+            if not item["future"].done(): # The client may have gone away
+                item["future"].set_result(result)
+
+    def metrics_snapshot(self):
+        return self.metrics.snapshot(self.queue_depth, len(self.sessions), self.busy_sessions)
+
+# ------------------ HTTP ------------------
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+def http_response(status, payload, keep_alive):
+    body = (payload if isinstance(payload, str) else json.dumps(payload)).encode()
+    content_type = "text/plain" if isinstance(payload, str) else "application/json"
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+async def read_request(reader):
+    """Reads one HTTP/1.1 request; returns (method, path, headers, body) or None at end of stream."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise RequestError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise RequestError(400, "invalid Content-Length header")
+    if length < 0:
+        raise RequestError(400, "invalid Content-Length header")
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+async def handle_request(batcher, method, path, body):
+    if path == "/healthz":
+        return 200, "ok"
+    if path == "/metrics":
+        return 200, batcher.metrics_snapshot()
+    if path != "/segment":
+        raise RequestError(404, f"unknown path {path}")
+    if method != "POST":
+        raise RequestError(405, "use POST")
+    try:
+        request = json.loads(body)
+    except ValueError:
+        request = None
+    if not isinstance(request, dict) or "features" not in request:
+        raise RequestError(400, "body must be a JSON object with a 'features' array")
+    start_unit = request.get("start_unit", 0)
+    if not isinstance(start_unit, int) or isinstance(start_unit, bool): # No silent 2.7 -> 2 or "3" -> 3
+        raise RequestError(400, "start_unit must be an integer")
+    features = request["features"]
+    try:
+        attention_weights, boundaries = await batcher.segment(features, start_unit)
+    except (ValueError, TypeError, OverflowError):
+        raise RequestError(400, "features must be a rectangular array of numbers")
+    return 200, {"boundary": int(attention_weights.argmax()), "boundaries": boundaries, "attention_weights": attention_weights.tolist()}
+
+def make_connection_handler(batcher):
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = await handle_request(batcher, method, path, body)
+                except RequestError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    # Answer instead of dropping the connection, then close it in case its state is unknown
+                    print(f"Request failed: {e!r}")
+                    status, payload, keep_alive = 500, {"error": "internal server error"}, False
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return handle_connection
+
+async def serve(args):
+    batcher = MicroBatcher(args.model, args.sessions, args.max_batch_size, args.max_wait_ms, args.max_batch_tokens,
+                           args.max_queue_depth, args.intra_op_threads,
+                           {"threshold": args.threshold, "relative_threshold": args.relative_threshold, "min_gap": args.min_gap})
+    await batcher.start()
+    server = await asyncio.start_server(make_connection_handler(batcher), args.host, args.port, backlog=1024)
+    print(f"Serving {args.model} on http://{args.host}:{args.port} with {args.sessions} session(s), "
+          f"batches of up to {args.max_batch_size} and a {args.max_wait_ms} ms wait")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SEGBOT ONNX inference with dynamic micro-batching")
+    parser.add_argument("--model", default="segbot.onnx", help="Path to segbot.onnx (or one of its variants)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sessions", type=int, default=2, help="ORT sessions that run batches concurrently")
+    parser.add_argument("--intra-op-threads", type=int, help="Threads per session (default: cores / sessions)")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Longest a request waits for its batch to fill")
+    parser.add_argument("--max-batch-tokens", type=int, help="Cap on padded units (rows * longest sequence) per batch")
+    parser.add_argument("--max-queue-depth", type=int, default=1024, help="Requests beyond this are rejected with 503")
+    parser.add_argument("--threshold", type=float, default=0.0, help="Minimum attention weight of a boundary")
+    parser.add_argument("--relative-threshold", type=float, default=0.5, help="Minimum weight relative to the row maximum")
+    parser.add_argument("--min-gap", type=int, default=1, help="Minimum distance in units between boundaries")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"{args.model} not found. Export it first with: python convert_segbot_to_onnx.py")
+        sys.exit(1)
+    if importlib.util.find_spec("onnxruntime") is None:
+        print("onnxruntime is required to serve SEGBOT:")
+        print("pip install onnxruntime")
+        sys.exit(1)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,363 @@
 import sys
+import argparse
 import subprocess
 import shutil
 import platform
 import os
-import textwrap
-import urllib.request
 import tempfile
 import json
+import hashlib
+import functools
+import threading
+import queue
+import copy
+import time
+import re
+import unicodedata
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional
 
-# Install third-party packages if missing
-for pkg in ["rich", "questionary"]:
-    try:
-        __import__(pkg)
-    except ImportError:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.align import Align
-from rich import box
-from rich.markdown import Markdown
-from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
-import questionary
-
-console = Console()
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 STATE_FILE = ".vibe.json"
+STATE_LOCK_FILE = ".vibe.json.lock"
+STATE_SCHEMA_VERSION = 3
+TIMING_HISTORY = 20 # Runs of timing history kept per step
 FIREBASE_CLI = "firebase.cmd" if platform.system() == "Windows" else "firebase"
 NPM_CLI = "npm.cmd" if platform.system() == "Windows" else "npm"
+LOG_DIR = ".vibe-logs"
+# mongodb-memory-server's own default download directory, so tests find binaries fetched here
+MONGODB_CACHE_DIR = os.environ.get("VIBE_MONGODB_CACHE") or os.environ.get("MONGOMS_DOWNLOAD_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "mongodb-binaries")
+# Used only when the installed mongodb-memory-server-core cannot be inspected (its 10.1.x default)
+FALLBACK_MONGODB_VERSION = "7.0.14"
+
+# ------------------ Console ------------------
+
+# Only the markup this script writes, so literal brackets in messages survive
+MARKUP_PATTERN = re.compile(r"\[/?(?:bold|dim|italic|red|green|yellow|blue|cyan|white|magenta|link)(?:[ =][^\[\]]*)?\]|\[/\]")
+
+def strip_markup(text):
+    return MARKUP_PATTERN.sub("", text)
+
+def load_ui():
+    """
+    Imports the interactive UI stack (rich, questionary), installing it first if missing, and
+    returns a rich Console. Reports, --plan and headless runs never call this.
+    """
+    for pkg in ["rich", "questionary"]:
+        try:
+            __import__(pkg)
+        except ImportError:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
+    from rich.console import Console
+    return Console()
+
+class PlainConsole:
+    """
+    Stand-in for rich's Console that prints markup-free text. With log_format "plain" lines get a
+    timestamp, with "json" each line is a JSON object; None prints bare text (for reports).
+    """
+    def __init__(self, log_format: Optional[str] = None):
+        self.log_format = log_format
+        self.lock = threading.Lock()
+
+    def emit(self, record: Dict):
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **record}
+        with self.lock:
+            if self.log_format == "json":
+                print(json.dumps(record, ensure_ascii=False), flush=True)
+            else:
+                print(f"{record['time']} {record.get('message', '')}", flush=True)
+
+    def print(self, *objects, **kwargs):
+        text = strip_markup(" ".join(str(obj) for obj in objects))
+        if self.log_format is None:
+            with self.lock:
+                print(text, flush=True)
+            return
+        for line in text.strip().splitlines():
+            if line.strip():
+                self.emit({"message": line.strip()})
+
+class LazyConsole:
+    """
+    The module console: rich's Console, loaded on first use, unless use_console() set another one.
+    While held (see hold_output()) prints from other threads are queued instead of written.
+    """
+    target = None
+    held = None
+    held_lock = threading.Lock()
 
-def clear_screen():
-    if platform.system() == "Windows":
-        subprocess.run(["cls"], shell=True)
-    else:
-        subprocess.run(["clear"], shell=True)
+    def __getattr__(self, name):
+        if LazyConsole.target is None:
+            LazyConsole.target = load_ui()
+        return getattr(LazyConsole.target, name)
+
+    def print(self, *objects, **kwargs):
+        with LazyConsole.held_lock:
+            if LazyConsole.held is not None and threading.current_thread() is not threading.main_thread():
+                LazyConsole.held.append((objects, kwargs))
+                return
+        self.__getattr__("print")(*objects, **kwargs)
+
+@contextmanager
+def hold_output():
+    """Keeps background threads off the terminal (e.g. while a prompt is open), then prints what they queued."""
+    with LazyConsole.held_lock:
+        LazyConsole.held = []
+    try:
+        yield
+    finally:
+        with LazyConsole.held_lock:
+            queued, LazyConsole.held = LazyConsole.held, None
+        for objects, kwargs in queued:
+            console.print(*objects, **kwargs)
+
+def use_console(target):
+    LazyConsole.target = target
+
+def rich_console():
+    if LazyConsole.target is None:
+        LazyConsole.target = load_ui()
+    return LazyConsole.target
+
+def rich_loaded():
+    return LazyConsole.target is not None and not isinstance(LazyConsole.target, PlainConsole)
+
+console = LazyConsole()
+
+def display_width(text):
+    return sum(0 if unicodedata.combining(char) else 2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+
+def print_table(title, columns, rows):
+    """
+    Prints a table of markup strings. columns is a list of (header, justify). Rendered with rich
+    when the UI is loaded, otherwise as plain text so reports do not need to import it.
+    """
+    if rich_loaded():
+        from rich import box
+        from rich.table import Table
+        table = Table(title=title, box=box.ROUNDED)
+        for header, justify in columns:
+            table.add_column(header, justify=justify)
+        for row in rows:
+            table.add_row(*row)
+        console.print(table)
+        return
+
+    rows = [[strip_markup(cell) for cell in row] for row in rows]
+    headers = [header for header, _ in columns]
+    widths = [max(display_width(cell) for cell in [header] + [row[i] for row in rows]) for i, header in enumerate(headers)]
+    def format_row(cells):
+        parts = []
+        for cell, width, (_, justify) in zip(cells, widths, columns):
+            padding = " " * (width - display_width(cell))
+            if justify == "right":
+                parts.append(padding + cell)
+            elif justify == "center":
+                parts.append(padding[:len(padding) // 2] + cell + padding[len(padding) // 2:])
+            else:
+                parts.append(cell + padding)
+        return "  ".join(parts).rstrip()
+    console.print(title)
+    console.print(format_row(headers))
+    console.print("  ".join("-" * width for width in widths))
+    for row in rows:
+        console.print(format_row(row))
+
+# ------------------ Input Fingerprints ------------------
+
+def file_digest(path):
+    """Short content hash of a file, or "missing"."""
+    if not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def tree_digest(root, exclude=("node_modules", ".git", "build", "coverage")):
+    """Hash over the paths, sizes and modification times of a source tree; stats only, no reads."""
+    if not os.path.isdir(root):
+        return "missing"
+    digest = hashlib.sha256()
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if name not in exclude)
+        for name in sorted(filenames):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, root)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+@functools.lru_cache(maxsize=None)
+def tool_version(command):
+    """Output of `<command> --version`, or "missing" when the tool is not installed."""
+    if shutil.which(command) is None:
+        return "missing"
+    try:
+        result = subprocess.run([command, "--version"], capture_output=True, text=True, timeout=30, shell=(platform.system() == "Windows"))
+        return result.stdout.strip().splitlines()[0] if result.stdout.strip() else "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+def directory_bytes(path):
+    """Apparent size of a directory tree, counting hard-linked files (pnpm's store links) once."""
+    total, seen = 0, set()
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if (stat.st_dev, stat.st_ino) not in seen:
+                        seen.add((stat.st_dev, stat.st_ino))
+                        total += stat.st_size
+            except OSError:
+                continue
+    return total
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_seconds(seconds):
+    return f"{seconds:.1f}s" if seconds < 60 else f"{int(seconds // 60)}m{seconds % 60:04.1f}s"
+
+def fingerprint_hash(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
 
 # ------------------ Pipeline State Manager ------------------
 
+@contextmanager
+def file_lock(path):
+    """Exclusive lock shared between setup processes (e.g. two terminals running setup)."""
+    with open(path, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def migrate_v1(state):
+    # Version 1 had no schema version and no fingerprints
+    state.setdefault("fingerprints", {})
+    return state
+
+def migrate_v2(state):
+    # Version 3 replaced the separate package install steps with one workspace install
+    for name in ("Backend Packages", "Frontend Packages"):
+        state.pop(name, None)
+        for section in ("fingerprints", "timings"):
+            state.get(section, {}).pop(name, None)
+    return state
+
+# Migration from version N to N + 1
+STATE_MIGRATIONS = {1: migrate_v1, 2: migrate_v2}
+
 class SetupState:
+    """
+    The .vibe.json store. Changes are made inside transaction(), which takes a thread lock and a
+    file lock, re-reads the file so changes from other processes are kept, and writes the result
+    once, atomically (temp file + rename), when the outermost transaction ends. update() on its
+    own is a one-key transaction.
+    """
     def __init__(self):
         self.state = {}
+        # Steps run on worker threads, so transactions must not interleave
+        self.lock = threading.RLock()
+        self.depth = 0
         self.load()
 
     def load(self):
-        if os.path.exists(STATE_FILE):
+        if not os.path.exists(STATE_FILE):
+            self.state = {"schema_version": STATE_SCHEMA_VERSION}
+            return
+        try:
             with open(STATE_FILE, "r") as f:
                 self.state = json.load(f)
+        except ValueError:
+            backup = STATE_FILE + ".corrupt"
+            os.replace(STATE_FILE, backup)
+            console.print(f"[yellow]⚠ {STATE_FILE} was unreadable and has been moved to {backup}; starting with a fresh state.[/yellow]")
+            self.state = {"schema_version": STATE_SCHEMA_VERSION}
+            return
+        self.migrate()
+
+    def migrate(self):
+        version = self.state.get("schema_version", 1)
+        if version > STATE_SCHEMA_VERSION:
+            console.print(f"[red]❌ {STATE_FILE} was written by a newer setup script (schema {version}). Update your checkout.[/red]")
+            sys.exit(1)
+        while version < STATE_SCHEMA_VERSION:
+            self.state = STATE_MIGRATIONS[version](self.state)
+            version += 1
+        self.state["schema_version"] = version
 
     def save(self):
-        with open(STATE_FILE, "w") as f:
-            json.dump(self.state, f, indent=2)
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(STATE_FILE))
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".vibe-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.state, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, STATE_FILE)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+    @contextmanager
+    def transaction(self):
+        """Batches changes into one write; on an exception the changes are rolled back and nothing is written."""
+        with self.lock:
+            if self.depth > 0:
+                self.depth += 1
+                try:
+                    yield self
+                finally:
+                    self.depth -= 1
+                return
+            with file_lock(STATE_LOCK_FILE):
+                self.load()
+                snapshot = copy.deepcopy(self.state)
+                self.depth = 1
+                try:
+                    yield self
+                except BaseException:
+                    self.state = snapshot
+                    raise
+                finally:
+                    self.depth = 0
+                self.save()
 
     def update(self, key: str, value):
-        self.state[key] = value
-        self.save()
+        with self.transaction():
+            self.state[key] = value
 
     def get(self, key: str, default=None):
         return self.state.get(key, default)
@@ -65,15 +365,55 @@ class SetupState:
     def show_summary(self):
         console.print("\n[bold cyan]Setup Summary[/bold cyan]")
         self.print_final_progress_table()
+        if self.get("timings"):
+            self.print_profile(limit=3)
 
-    def print_final_progress_table(self):
-        table = Table(title="ViBe Setup Progress", box=box.ROUNDED)
-        table.add_column("#", justify="center")
-        table.add_column("Step", justify="left")
-        table.add_column("Description", justify="left")
-        table.add_column("Status", justify="center")
+    def record_timing(self, name: str, entry: Dict):
+        with self.transaction():
+            timings = dict(self.get("timings", {}))
+            timings[name] = (timings.get(name, []) + [entry])[-TIMING_HISTORY:]
+            self.update("timings", timings)
+
+    def print_profile(self, limit: Optional[int] = None):
+        """Steps ordered by their latest wall time, with the change against their earlier runs."""
+        timings = self.get("timings", {})
+        if not timings:
+            console.print("[red]No step timings recorded yet. Run the setup first.[/red]")
+            return
+
+        columns = [("Step", "left"), ("Last wall", "right"), ("Child CPU", "right"), ("node_modules", "right"),
+                   ("Avg before", "right"), ("Trend", "right"), ("Runs", "right")]
+        table_rows = []
+        rows = sorted(timings.items(), key=lambda item: item[1][-1]["wall_seconds"], reverse=True)
+        for name, history in rows[:limit]:
+            last, earlier = history[-1], history[:-1]
+            if earlier:
+                average = sum(run["wall_seconds"] for run in earlier) / len(earlier)
+                change = (last["wall_seconds"] - average) / average * 100 if average else 0
+                color = "red" if change > 10 else "green" if change < -10 else "white"
+                trend = f"[{color}]{'▲' if change > 0 else '▼'} {abs(change):.0f}%[/{color}]"
+                average_text = format_seconds(average)
+            else:
+                trend, average_text = "-", "-"
+            label = name + (" [dim](interactive)[/dim]" if last.get("interactive") else "")
+            if last["status"] != "done":
+                label += f" [red]({last['status']})[/red]"
+            node_modules = format_bytes(last["node_modules_bytes"]) if last.get("node_modules_bytes") is not None else "-"
+            table_rows.append([label, format_seconds(last["wall_seconds"]), format_seconds(last["cpu_seconds"]),
+                               node_modules, average_text, trend, str(len(history))])
+        print_table("ViBe Setup Profile (slowest first)", columns, table_rows)
 
+        runs = self.get("runs", [])
+        if runs:
+            last_run = runs[-1]
+            console.print(f"Last setup run: {format_seconds(last_run['wall_seconds'])} wall for "
+                          f"{format_seconds(last_run['step_seconds'])} of step time ({last_run['steps_run']} step(s) run).")
+
+    def print_final_progress_table(self):
+        columns = [("#", "center"), ("Step", "left"), ("Description", "left"), ("Status", "center"), ("Last run", "right")]
+        rows = []
         steps = self.get("steps", [])
+        timings = self.get("timings", {})
 
         if not steps:
             console.print("[red]No steps found in state. Cannot show summary.[/red]")
@@ -84,26 +424,129 @@ class SetupState:
                 status = "✅"
             else:
                 status = "❌"
-            table.add_row(str(index), step["name"], step["description"], status) #Access name and description as dictionary keys
+            history = timings.get(step["name"])
+            last_run = format_seconds(history[-1]["wall_seconds"]) if history else "-"
+            rows.append([str(index), step["name"], step["description"], status, last_run]) #Access name and description as dictionary keys
 
-        console.print(table)
+        print_table("ViBe Setup Progress", columns, rows)
 
 # ------------------ Base Step Class ------------------
 
+class StepError(Exception):
+    """Raised by a step to fail it; the pipeline cancels the steps that depend on it."""
+
 class PipelineStep:
-    def __init__(self, name: str, description: str, instructions: Optional[str] = None):
+    def __init__(self, name: str, description: str, instructions: Optional[str] = None,
+                 depends_on: Optional[List[str]] = None, interactive: bool = False):
         self.name = name
         self.description = description
         self.instructions = instructions
+        # Names of the steps that must finish before this one starts
+        self.depends_on = depends_on or []
+        # Interactive steps need the terminal, so they run on the main thread with the live display paused
+        self.interactive = interactive
+        # Set by the pipeline: output of background commands goes here instead of the terminal
+        self.log_path: Optional[str] = None
+        # Headless settings (see load_headless_config); None for an interactive run
+        self.config: Optional[Dict] = None
+        # CPU time used by the commands this step ran, in seconds
+        self.cpu_seconds = 0.0
+        self.cpu_lock = threading.Lock()
+
+    def fingerprint_inputs(self) -> Dict[str, str]:
+        """
+        Values that decide whether a completed step is still up to date (lockfile hashes, tool
+        versions, ...). The step re-runs when any of them changes. Steps without inputs run once.
+        """
+        return {}
+
+    def recorded_fingerprint(self, state: SetupState) -> Optional[Dict]:
+        return state.get("fingerprints", {}).get(self.name)
+
+    def record_fingerprint(self, state: SetupState):
+        inputs = self.fingerprint_inputs()
+        with state.transaction():
+            fingerprints = dict(state.get("fingerprints", {}))
+            fingerprints[self.name] = {"hash": fingerprint_hash(inputs), "inputs": inputs}
+            state.update("fingerprints", fingerprints)
+
+    def record_failure(self, state: SetupState):
+        """Marks the step as not completed and drops its fingerprint, so reports are accurate and the next run retries it."""
+        with state.transaction():
+            state.update(self.name, False)
+            fingerprints = dict(state.get("fingerprints", {}))
+            fingerprints.pop(self.name, None)
+            state.update("fingerprints", fingerprints)
+
+    def run_reason(self, state: SetupState) -> Optional[str]:
+        """Why the step has to run, or None when it is up to date."""
+        if not state.get(self.name):
+            return "not completed yet"
+        recorded = self.recorded_fingerprint(state)
+        if recorded is None:
+            return None # Completed before fingerprints were recorded; adopted by the pipeline
+        inputs = self.fingerprint_inputs()
+        if fingerprint_hash(inputs) == recorded["hash"]:
+            return None
+        changed = sorted(key for key in set(inputs) | set(recorded["inputs"]) if inputs.get(key) != recorded["inputs"].get(key))
+        return f"changed: {', '.join(changed)}"
 
     def should_run(self, state: SetupState) -> bool:
-        return not state.get(self.name)
+        return self.run_reason(state) is not None
+
+    @property
+    def headless(self) -> bool:
+        return self.config is not None
+
+    @property
+    def foreground(self) -> bool:
+        """Whether the step needs the terminal: interactive steps, unless running headless."""
+        return self.interactive and not self.headless
+
+    def node_modules_dirs(self) -> List[str]:
+        """node_modules directories this step writes to; their growth is recorded with its timing."""
+        return []
+
+    def run_command(self, args, cwd=None, check=True, **kwargs):
+        """
+        Runs a command, sending its output to the step log when the step runs in the background,
+        and adds the CPU time of the command (and everything it waited for) to cpu_seconds.
+        """
+        log_file = None
+        if self.log_path is not None and not self.foreground:
+            log_file = open(self.log_path, "a")
+            log_file.write(f"$ {' '.join(args)}\n")
+            log_file.flush()
+            kwargs.update(stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            process = subprocess.Popen(args, cwd=cwd, shell=(platform.system() == "Windows"), **kwargs)
+            self.wait_for(process)
+        finally:
+            if log_file is not None:
+                log_file.close()
+        if check and process.returncode != 0:
+            where = f" (see {self.log_path})" if log_file is not None else ""
+            raise StepError(f"`{' '.join(args)}` exited with code {process.returncode}{where}")
+        return subprocess.CompletedProcess(args, process.returncode)
+
+    def wait_for(self, process):
+        """Waits for a process started by this step and adds its CPU time to cpu_seconds."""
+        if hasattr(os, "wait4"):
+            # Per-child resource usage; os.times() would mix in the commands of concurrent steps
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            with self.cpu_lock:
+                self.cpu_seconds += usage.ru_utime + usage.ru_stime
+        else:
+            process.wait()
+        return process.returncode
 
     def run(self, state: SetupState):
         raise NotImplementedError("Each step must implement a run method")
 
     def display_instructions(self):
         if self.instructions:
+            from rich.panel import Panel
             console.print(Panel(self.instructions, title=f"[bold cyan]{self.name} - Instructions[/bold cyan]"))
 
 # ------------------ Step Implementations ------------------
@@ -113,13 +556,22 @@ class WelcomeStep(PipelineStep):
         super().__init__("Welcome", "Select environment")
 
     def run(self, state):
-        title = Text("🚀 ViBe Setup Wizard 🚀", style="bold white on blue", justify="center")
-        console.print(Align.center(title))
-        panel = Panel("[green]Welcome to the ViBe backend setup process![/green]", title="[bold cyan]Welcome[/bold cyan]", border_style="green", box=box.ROUNDED)
-        console.print("\n")
-        console.print(panel)
-        console.print("\n")
-        environment = questionary.select("Choose environment:", choices=["Development", "Production"]).ask()
+        if self.headless:
+            environment = self.config["environment"]
+            console.print(f"Environment: {environment}")
+        else:
+            from rich import box
+            from rich.align import Align
+            from rich.panel import Panel
+            from rich.text import Text
+            import questionary
+            title = Text("🚀 ViBe Setup Wizard 🚀", style="bold white on blue", justify="center")
+            console.print(Align.center(title))
+            panel = Panel("[green]Welcome to the ViBe backend setup process![/green]", title="[bold cyan]Welcome[/bold cyan]", border_style="green", box=box.ROUNDED)
+            console.print("\n")
+            console.print(panel)
+            console.print("\n")
+            environment = questionary.select("Choose environment:", choices=["Development", "Production"]).ask()
         state.update("environment", environment)
         if environment == "Development":
             pass
@@ -133,6 +585,13 @@ class ToolchainCheckStep(PipelineStep):
     def __init__(self):
         super().__init__("ToolChain Check", "Verify Node.js, npm, pnpm, and firebase-tools are installed")
 
+    def fingerprint_inputs(self):
+        return {
+            "node": tool_version("node"),
+            "pnpm": tool_version("pnpm"),
+            "firebase": shutil.which(FIREBASE_CLI) or "missing",
+        }
+
     def run(self, state):
         def check_command_exists(command):
             return shutil.which(command) is not None
@@ -141,52 +600,69 @@ class ToolchainCheckStep(PipelineStep):
             console.print("[yellow]⚠ Node.js is not installed. Installing using fnm...[/yellow]")
             try:
                 if platform.system() == "Windows":
-                    subprocess.run(["winget", "install", "Schniz.fnm"], check=True)
+                    self.run_command(["winget", "install", "Schniz.fnm"])
                 else:
                     subprocess.run("curl -o- https://fnm.vercel.app/install | bash", check=True, shell=True)
-                subprocess.run(["fnm", "install", "22"], check=True)
-            except subprocess.CalledProcessError as e:
-                console.print(f"[red]❌ Failed to install Node.js: {e}[/red]")
-                sys.exit(1)
+                self.run_command(["fnm", "install", "22"])
+            except (subprocess.CalledProcessError, StepError) as e:
+                raise StepError(f"Failed to install Node.js: {e}")
             console.print("[green]✅ Node.js installed successfully.[/green]")
             
         if not check_command_exists("npm"):
-            console.print("[red]❌ npm is not installed.")
-            sys.exit(1)
+            raise StepError("npm is not installed.")
         if not check_command_exists("pnpm"):
             console.print("[yellow]⚠ Installing pnpm...[/yellow]")
-            subprocess.run([NPM_CLI, "install", "-g", "pnpm"], check=True, shell=(platform.system() == "Windows"))
+            self.run_command([NPM_CLI, "install", "-g", "pnpm"])
 
         if not check_command_exists("firebase"):
             console.print("[yellow]⚠ Installing firebase-tools...[/yellow]")
-            subprocess.run(["pnpm", "install", "-g", "firebase-tools"], check=True, shell=(platform.system() == "Windows"))
-
-        console.print(":white_check_mark: [green]Toolchain verified.[/green]")
-        
-        # run pnpm install command in the current directory
-        console.print("[yellow]⚠ Installing pnpm dependencies...[/yellow]")
-        subprocess.run(["pnpm", "install"], check=True, shell=(platform.system() == "Windows"))
-        console.print("[green]✅ pnpm dependencies installed successfully.[/green]")
+            self.run_command(["pnpm", "install", "-g", "firebase-tools"])
+
+        console.print("[green]✅ Toolchain verified.[/green]")
         state.update(self.name, True)
 
 class FirebaseLoginStep(PipelineStep):
     def __init__(self):
-        super().__init__("Firebase Login", "Ensure Firebase CLI is logged in")
+        super().__init__("Firebase Login", "Ensure Firebase CLI is logged in",
+                         depends_on=["ToolChain Check"], interactive=True)
 
     def run(self, state):
+        if self.headless and os.environ.get("FIREBASE_TOKEN"):
+            state.update(self.name, True)
+            return
         result = subprocess.run([FIREBASE_CLI, "login:list"], capture_output=True, text=True, shell=(platform.system() == "Windows"))
         if "No authorized accounts" in result.stdout:
+            if self.headless:
+                raise StepError("Firebase CLI is not logged in. Run `firebase login` once, or set FIREBASE_TOKEN (from `firebase login:ci`).")
             subprocess.run([FIREBASE_CLI, "login"], check=True, shell=(platform.system() == "Windows"))
         state.update(self.name, True)
 
 class FirebaseEmulatorsStep(PipelineStep):
     def __init__(self, backend_dir):
         super().__init__("Emulators", "Initialize Firebase emulators",
-                                    instructions="Please choose ONLY the following emulators when prompted:\n\n✔ Authentication Emulator\n✔ Functions Emulator\n✔ Emulator UI [optional but recommended]")
+                                    instructions="Please choose ONLY the following emulators when prompted:\n\n✔ Authentication Emulator\n✔ Functions Emulator\n✔ Emulator UI [optional but recommended]",
+                                    depends_on=["Firebase Login"], interactive=True)
         self.backend_dir = backend_dir
 
+    def emulators_configured(self):
+        try:
+            with open(os.path.join(self.backend_dir, "firebase.json")) as f:
+                return "emulators" in json.load(f)
+        except (OSError, ValueError):
+            return False
+
+    def fingerprint_inputs(self):
+        # Only the emulators section matters; other edits to firebase.json must not re-run the wizard
+        return {"firebase.json emulators": "configured" if self.emulators_configured() else "missing"}
+
     def run(self, state):
-        subprocess.run([FIREBASE_CLI, "init", "emulators"], cwd=self.backend_dir, check=True, shell=(platform.system() == "Windows"))
+        if self.headless:
+            # `firebase init` is a prompt-driven wizard; headless runs use the committed emulator config
+            if not self.emulators_configured():
+                firebase_json = os.path.join(self.backend_dir, "firebase.json")
+                raise StepError(f"No emulators configured in {firebase_json}; run `firebase init emulators` interactively once.")
+        else:
+            subprocess.run([FIREBASE_CLI, "init", "emulators"], cwd=self.backend_dir, check=True, shell=(platform.system() == "Windows"))
         state.update(self.name, True)
 
 class EnvFileStep(PipelineStep):
@@ -204,142 +680,913 @@ class EnvFileStep(PipelineStep):
                                     7.  Copy the connection string.
                                     8.  [bold red]Replace '<password>' in the copied string with the actual password[/bold red] you created for the database user.
                                     9.  Paste the modified connection string below.
-                                    """)
+                                    """, interactive=True)
         self.backend_dir = backend_dir
 
+    def fingerprint_inputs(self):
+        return {".env": file_digest(os.path.join(self.backend_dir, ".env"))}
+
     def run(self, state):
         env_path = os.path.join(self.backend_dir, ".env")
         if not os.path.exists(env_path):
-            uri = questionary.text("Paste your MongoDB URI:").ask()
+            if self.headless:
+                uri = self.config.get("db_url")
+                if not uri:
+                    raise StepError(f"{env_path} does not exist and no DB_URL was given (set DB_URL or \"db_url\" in the config file).")
+            else:
+                import questionary
+                uri = questionary.text("Paste your MongoDB URI:").ask()
             with open(env_path, "w") as f:
                 f.write(f"DB_URL=\"{uri}\"\n")
         state.update(self.name, True)
 
-class PackageInstallStep(PipelineStep):
-    def __init__(self, backend_dir):
-        super().__init__("Backend Packages", "Install backend dependencies")
-        self.backend_dir = backend_dir
+class WorkspaceInstallStep(PipelineStep):
+    """
+    One pnpm install for the workspace in pnpm-workspace.yaml, filtered to the root and the packages
+    setup needs (and their workspace dependencies), instead of separate installs in each directory.
+    The cli package provides the `vibe` command the root package.json links, and `vibe start docs`
+    needs the docs package, so both are part of the default set.
+    The step is skipped when the lockfile, manifests and node_modules are as the last install left them.
+
+    Environment:
+        VIBE_PNPM_OFFLINE=1   install from the local store only, without network requests
+        VIBE_PNPM_STORE       store directory, e.g. one prefetched with `pnpm fetch` in a CI cache or image layer
+        VIBE_NPM_REGISTRY     registry URL, e.g. a local stand-in registry (verdaccio) for testing
+    """
+    def __init__(self, root_dir, packages=("backend", "frontend", "cli", "docs")):
+        super().__init__("Workspace Packages", f"Install root, {', '.join(packages)} dependencies in one pnpm install",
+                         depends_on=["ToolChain Check"])
+        self.root_dir = root_dir
+        self.packages = list(packages)
+
+    def install_command(self):
+        command = ["pnpm", "install", "--include-workspace-root"]
+        # A filter matching no project makes pnpm skip it, but checkouts without e.g. docs/package.json
+        # are left out explicitly so the command shows what is installed
+        for package in self.packages:
+            if not os.path.exists(os.path.join(self.root_dir, package, "package.json")):
+                continue
+            command += ["--filter", f"{{./{package}}}..."] # The package directory and its dependencies
+        # Offline-first: the network is only used for packages missing from the store
+        command.append("--offline" if os.environ.get("VIBE_PNPM_OFFLINE") == "1" else "--prefer-offline")
+        if os.environ.get("VIBE_PNPM_STORE"):
+            command += ["--store-dir", os.environ["VIBE_PNPM_STORE"]]
+        if os.environ.get("VIBE_NPM_REGISTRY"):
+            command += ["--registry", os.environ["VIBE_NPM_REGISTRY"]]
+        return command
+
+    def fingerprint_inputs(self):
+        inputs = {
+            "node": tool_version("node"),
+            "pnpm-lock.yaml": file_digest(os.path.join(self.root_dir, "pnpm-lock.yaml")),
+            "pnpm-workspace.yaml": file_digest(os.path.join(self.root_dir, "pnpm-workspace.yaml")),
+            "package.json": file_digest(os.path.join(self.root_dir, "package.json")),
+            # Rewritten by every pnpm install, so an install made outside setup is noticed too
+            "node_modules/.modules.yaml": file_digest(os.path.join(self.root_dir, "node_modules", ".modules.yaml")),
+            "packages": ",".join(self.packages),
+        }
+        for package in self.packages:
+            inputs[f"{package}/package.json"] = file_digest(os.path.join(self.root_dir, package, "package.json"))
+            inputs[f"{package}/node_modules"] = "present" if os.path.isdir(os.path.join(self.root_dir, package, "node_modules")) else "missing"
+        return inputs
+
+    def node_modules_dirs(self):
+        return [os.path.join(self.root_dir, "node_modules")] + [os.path.join(self.root_dir, package, "node_modules") for package in self.packages]
 
     def run(self, state):
-        with console.status("Installing backend dependencies..."):
-            subprocess.run(["pnpm", "install"], cwd=self.backend_dir, check=True, shell=(platform.system() == "Windows"))
-            state.update(self.name, True)
+        console.print(f"[yellow]⚠ Installing workspace dependencies ({', '.join(['root'] + self.packages)})...[/yellow]")
+        self.run_command(self.install_command(), cwd=self.root_dir)
+        console.print("[green]✅ Workspace dependencies installed successfully.[/green]")
+        state.update(self.name, True)
+
+def mongodb_binary_version(backend_dir):
+    """
+    The MongoDB version mongodb-memory-server will ask for, resolved the way it does: MONGOMS_VERSION,
+    then config.mongodbMemoryServer.version in package.json, then the installed core package's default.
+    """
+    if os.environ.get("MONGOMS_VERSION"):
+        return os.environ["MONGOMS_VERSION"]
+    for package_dir in (backend_dir, os.path.dirname(backend_dir)):
+        try:
+            with open(os.path.join(package_dir, "package.json")) as f:
+                version = json.load(f).get("config", {}).get("mongodbMemoryServer", {}).get("version")
+        except (OSError, ValueError):
+            version = None
+        if version:
+            return version
+    # pnpm links mongodb-memory-server into .pnpm/, next to the core package it depends on
+    wrapper = os.path.realpath(os.path.join(backend_dir, "node_modules", "mongodb-memory-server"))
+    resolve_config = os.path.join(os.path.dirname(wrapper), "mongodb-memory-server-core", "lib", "util", "resolveConfig.js")
+    try:
+        with open(resolve_config) as f:
+            match = re.search(r"DEFAULT_VERSION\s*=\s*['\"]([\w.-]+)['\"]", f.read())
+        if match:
+            return match.group(1)
+    except OSError:
+        pass
+    return FALLBACK_MONGODB_VERSION
+
+# Asks mongodb-memory-server's DryMongoBinary for the binary file name it uses on this machine
+BINARY_NAME_SCRIPT = (
+    "import { DryMongoBinary } from 'mongodb-memory-server';"
+    "console.log(await DryMongoBinary.getBinaryName(await DryMongoBinary.generateOptions()));"
+)
+
+@functools.lru_cache(maxsize=None)
+def mongod_binary_name(backend_dir, version):
+    """
+    The mongod-<arch>-<distro>-<version> file name mongodb-memory-server uses for version on this
+    platform. A shared cache can hold binaries of other architectures and distros with the same
+    version, so only this exact name counts as a hit. Raises StepError when node cannot answer
+    (e.g. before the workspace install); failures are not cached.
+    """
+    env = dict(os.environ, MONGOMS_VERSION=version)
+    try:
+        result = subprocess.run(["node", "--input-type=module", "-e", BINARY_NAME_SCRIPT], cwd=backend_dir, env=env,
+                                capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise StepError(f"Could not ask mongodb-memory-server for the MongoDB binary name: {e}")
+    lines = result.stdout.split()
+    if result.returncode != 0 or not lines or not lines[-1].startswith("mongod-"):
+        errors = result.stderr.strip().splitlines()
+        # Node ends uncaught errors with its version line, so the error message itself is looked up
+        details = next((line.strip() for line in errors if "Error" in line), errors[0] if errors else "no output")
+        raise StepError(f"Could not ask mongodb-memory-server for the MongoDB binary name: {details}")
+    return lines[-1]
+
+def find_cached_mongod(cache_dir, binary_name):
+    """Path of the mongod binary called binary_name (see mongod_binary_name()) in cache_dir, or None."""
+    for name in (binary_name, binary_name + ".exe"):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
 
 class MongoDBBinaryStep(PipelineStep):
+    """
+    Makes sure the mongod binary mongodb-memory-server needs is in a shared cache directory
+    (VIBE_MONGODB_CACHE, MONGOMS_DOWNLOAD_DIR or ~/.cache/mongodb-binaries), which can be a volume
+    shared between checkouts and CI runners. Cached binaries are checked against the SHA-256
+    recorded in checksums.json; only a missing or corrupt binary is fetched, through
+    mongodb-memory-server's own downloader with plain node, without starting a server.
+    """
     def __init__(self, backend_dir):
-        super().__init__("MongoDB Test Binaries", "Ensure MongoDB binaries for in-memory server are downloaded")
+        super().__init__("MongoDB Test Binaries", "Ensure MongoDB binaries for in-memory server are downloaded",
+                         depends_on=["Workspace Packages"])
         self.backend_dir = backend_dir
+        self.cache_dir = MONGODB_CACHE_DIR
 
-    def run(self, state):
-        console.print("[cyan]Ensuring MongoDB binaries are downloaded for mongodb-memory-server...[/cyan]")
-        script = textwrap.dedent("""
-        import { MongoMemoryServer } from 'mongodb-memory-server';
-
-        (async () => {
-            const mongod = await MongoMemoryServer.create();
-            await mongod.getUri();
-            await mongod.stop();
-        })();
-        """)
+    def fingerprint_inputs(self):
+        version = mongodb_binary_version(self.backend_dir)
         try:
-            subprocess.run(["pnpx", "ts-node", "-e", script], check=True, cwd=self.backend_dir, shell=(platform.system() == "Windows"))
-            state.update(self.name, True)
-        except subprocess.CalledProcessError as e:
-            console.print(f"[red]❌ Failed to download MongoDB binaries: {e}[/red]")
-            sys.exit(1)
+            binary = find_cached_mongod(self.cache_dir, mongod_binary_name(self.backend_dir, version))
+        except StepError:
+            binary = None # Packages not installed yet; the step runs and resolves the name then
+        return {
+            "version": version,
+            "cache_dir": self.cache_dir,
+            "binary": os.path.basename(binary) if binary else "missing",
+            "platform": f"{platform.system()}-{platform.machine()}",
+        }
+
+    def checksums_path(self):
+        return os.path.join(self.cache_dir, "checksums.json")
+
+    def load_checksums(self):
+        try:
+            with open(self.checksums_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def verify(self, binary, version):
+        """
+        Checks binary against its recorded SHA-256, hashing only when its size or mtime changed since
+        it was last verified. A binary without a record (fetched by the tests themselves) is recorded.
+        """
+        stat = os.stat(binary)
+        name = os.path.basename(binary)
+        with file_lock(os.path.join(self.cache_dir, ".checksums.lock")):
+            checksums = self.load_checksums()
+            record = checksums.get(name)
+            if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+                return True
+            digest = hashlib.sha256()
+            with open(binary, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            if record and record["sha256"] != digest.hexdigest():
+                return False
+            checksums[name] = {"version": version, "sha256": digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".checksums-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(checksums, f, indent=2)
+            os.replace(temp_path, self.checksums_path())
+            return True
+
+    def fetch(self, version):
+        # MongoBinary.getPath() downloads (and md5-checks) the binary without starting mongod
+        script = "import { MongoBinary } from 'mongodb-memory-server'; console.log(await MongoBinary.getPath());"
+        env = dict(os.environ, MONGOMS_DOWNLOAD_DIR=self.cache_dir, MONGOMS_VERSION=version, MONGOMS_MD5_CHECK="1")
+        self.run_command(["node", "--input-type=module", "-e", script], cwd=self.backend_dir, env=env)
+
+    def run(self, state):
+        version = mongodb_binary_version(self.backend_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        binary_name = mongod_binary_name(self.backend_dir, version)
+        binary = find_cached_mongod(self.cache_dir, binary_name)
+        if binary and not self.verify(binary, version):
+            console.print(f"[yellow]⚠ Cached {os.path.basename(binary)} does not match its recorded checksum; fetching it again.[/yellow]")
+            os.remove(binary)
+            binary = None
+        if binary:
+            console.print(f"[green]✅ MongoDB {version} found in cache ({binary}).[/green]")
+        else:
+            console.print(f"[cyan]Fetching MongoDB {version} into {self.cache_dir}...[/cyan]")
+            try:
+                self.fetch(version)
+            except StepError as e:
+                raise StepError(f"Failed to download MongoDB binaries: {e}")
+            binary = find_cached_mongod(self.cache_dir, binary_name)
+            if binary is None:
+                raise StepError(f"mongodb-memory-server did not place {binary_name} in {self.cache_dir}")
+            self.verify(binary, version)
+        state.update(self.name, True)
+
+IMPORT_PATTERN = re.compile(r"""(?:\bfrom\s+|\bimport\s*\(\s*|\bimport\s+)['"]([^'"]+)['"]""")
+# File lines of vitest's default reporter, e.g. " ✓ src/modules/auth/tests/AuthController.test.ts (5 tests) 1203ms"
+VITEST_FILE_PATTERN = re.compile(r"^\s*([✓❯×])\s+(\S+\.test\.ts)")
+DEFAULT_TEST_SECONDS = 10.0 # Assumed duration of a test file that has not run yet
+DATABASE_START_TIMEOUT = 120 # Seconds a shard waits for its replica set to print its URI
+# Starts a one-node in-memory replica set (the services use transactions), prints its URI and
+# stops it when stdin closes
+REPLICA_SET_SCRIPT = """
+import { MongoMemoryReplSet } from 'mongodb-memory-server';
+const replSet = await MongoMemoryReplSet.create({ replSet: { count: 1 } });
+console.log(replSet.getUri());
+process.stdin.on('data', () => {});
+process.stdin.on('end', async () => { await replSet.stop(); process.exit(0); });
+"""
 
 class TestStep(PipelineStep):
+    """
+    Runs the backend vitest suite in shards: one vitest process per shard, each with its own
+    in-memory MongoDB replica set (DB_URL/DB_NAME are overridden per shard), VIBE_TEST_SHARDS at a
+    time (default: half the CPUs). Results are kept per test file in the state. A file is skipped
+    when it passed last time and neither it nor the sources it depends on (its module, the modules
+    that module imports, everything outside src/modules, and the test config) changed since;
+    files that failed last time run first.
+    """
     def __init__(self, backend_dir):
-        super().__init__("Backend Tests", "Run backend tests")
+        super().__init__("Backend Tests", "Run backend tests",
+                         depends_on=["Env Variables", "MongoDB Test Binaries"])
         self.backend_dir = backend_dir
+        self.src_dir = os.path.join(backend_dir, "src")
+        self.modules_dir = os.path.join(self.src_dir, "modules")
+        self.output_lock = threading.Lock()
 
-    def run(self, state):
-        with console.status("Running backend tests..."):
-            result = subprocess.run(["pnpm", "run", "test:ci"], cwd=self.backend_dir, shell=(platform.system() == "Windows"))
-            if result.returncode == 0:
-                console.print("[green]✅ All tests passed! Backend setup complete.")
-                state.update(self.name, True)
-            else:
-                console.print("[red]❌ Tests failed. Please fix and re-run the setup.")
-                sys.exit(1)
+    def fingerprint_inputs(self):
+        return {
+            "backend/src": tree_digest(os.path.join(self.backend_dir, "src")),
+            "backend/package.json": file_digest(os.path.join(self.backend_dir, "package.json")),
+            "backend/vite.config.ts": file_digest(os.path.join(self.backend_dir, "vite.config.ts")),
+            "backend/.env": file_digest(os.path.join(self.backend_dir, ".env")),
+            "pnpm-lock.yaml": file_digest(os.path.join(os.path.dirname(self.backend_dir), "pnpm-lock.yaml")),
+        }
+
+    def test_files(self):
+        # Matches `include: ['src/**/*.test.ts']` in vite.config.ts
+        files = []
+        for directory, dirnames, filenames in os.walk(self.src_dir):
+            dirnames[:] = sorted(name for name in dirnames if name != "node_modules")
+            for name in sorted(filenames):
+                if name.endswith(".test.ts"):
+                    files.append(os.path.relpath(os.path.join(directory, name), self.backend_dir).replace(os.sep, "/"))
+        return files
+
+    def module_of(self, path):
+        relative = os.path.relpath(path, self.modules_dir)
+        return None if relative.startswith("..") else relative.split(os.sep)[0]
+
+    def resolve_import(self, source_path, specifier):
+        if specifier.startswith("."):
+            return os.path.normpath(os.path.join(os.path.dirname(source_path), specifier))
+        if specifier.startswith("#root/"):
+            return os.path.join(self.src_dir, specifier[len("#root/"):])
+        if specifier.startswith("#"):
+            # package.json maps #courses/*, #users/*, ... to the module of the same name
+            module_dir = os.path.join(self.modules_dir, specifier[1:].split("/")[0])
+            return module_dir if os.path.isdir(module_dir) else None
+        return None
+
+    def module_dependencies(self):
+        """For each module, the modules it imports from directly or indirectly, itself included."""
+        if not os.path.isdir(self.modules_dir):
+            return {}
+        direct = {}
+        for module in sorted(os.listdir(self.modules_dir)):
+            module_dir = os.path.join(self.modules_dir, module)
+            if not os.path.isdir(module_dir):
+                continue
+            dependencies = {module}
+            for directory, _, filenames in os.walk(module_dir):
+                for name in filenames:
+                    if not name.endswith((".ts", ".js")):
+                        continue
+                    path = os.path.join(directory, name)
+                    with open(path, encoding="utf-8", errors="ignore") as f:
+                        specifiers = IMPORT_PATTERN.findall(f.read())
+                    for specifier in specifiers:
+                        target = self.resolve_import(path, specifier)
+                        dependency = self.module_of(target) if target else None
+                        if dependency:
+                            dependencies.add(dependency)
+            direct[module] = dependencies
 
-class FrontendPackageInstallStep(PipelineStep):
-    def __init__(self, frontend_dir):
-        super().__init__("Frontend Packages", "Install frontend dependencies")
-        self.frontend_dir = frontend_dir
+        closure = {}
+        for module in direct:
+            seen, stack = set(), [module]
+            while stack:
+                current = stack.pop()
+                if current in seen or current not in direct:
+                    continue
+                seen.add(current)
+                stack.extend(direct[current])
+            closure[module] = seen
+        return closure
+
+    def file_fingerprints(self, files):
+        shared = fingerprint_hash({
+            "src": tree_digest(self.src_dir, exclude=("node_modules", ".git", "build", "coverage", "modules")),
+            "package.json": file_digest(os.path.join(self.backend_dir, "package.json")),
+            "vite.config.ts": file_digest(os.path.join(self.backend_dir, "vite.config.ts")),
+            "tsconfig.json": file_digest(os.path.join(self.backend_dir, "tsconfig.json")),
+            ".env": file_digest(os.path.join(self.backend_dir, ".env")),
+            "pnpm-lock.yaml": file_digest(os.path.join(os.path.dirname(self.backend_dir), "pnpm-lock.yaml")),
+            "mongodb": mongodb_binary_version(self.backend_dir),
+        })
+        closure = self.module_dependencies()
+        module_digests = {module: tree_digest(os.path.join(self.modules_dir, module)) for module in closure}
+        fingerprints = {}
+        for path in files:
+            module = self.module_of(os.path.join(self.backend_dir, path))
+            modules = {name: module_digests[name] for name in sorted(closure.get(module, ()))}
+            fingerprints[path] = fingerprint_hash({"shared": shared, "test": file_digest(os.path.join(self.backend_dir, path)), "modules": modules})
+        return fingerprints
+
+    def make_shards(self, files, previous, count):
+        """Longest-processing-time assignment by last known durations; files are already in run order."""
+        shards = [[] for _ in range(count)]
+        loads = [0.0] * count
+        for path in files:
+            index = loads.index(min(loads))
+            shards[index].append(path)
+            loads[index] += previous.get(path, {}).get("duration_seconds", DEFAULT_TEST_SECONDS)
+        return [shard for shard in shards if shard]
+
+    def mongodb_env(self):
+        return dict(os.environ, MONGOMS_DOWNLOAD_DIR=MONGODB_CACHE_DIR, MONGOMS_VERSION=mongodb_binary_version(self.backend_dir))
+
+    def write_log(self, text):
+        if self.log_path is None:
+            return
+        with self.output_lock, open(self.log_path, "a") as log_file:
+            log_file.write(text)
+
+    def start_database(self, index):
+        """
+        Starts the replica set helper and waits up to DATABASE_START_TIMEOUT for its URI. stderr
+        (Node warnings, mongodb-memory-server logs) goes to the step log, and stdout lines that are
+        not a mongodb:// URI are logged too, so neither can be taken for the URI.
+        """
+        stderr = open(self.log_path, "a") if self.log_path is not None else subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(["node", "--input-type=module", "-e", REPLICA_SET_SCRIPT], cwd=self.backend_dir,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, text=True,
+                                       env=self.mongodb_env(), shell=(platform.system() == "Windows"))
+        finally:
+            if stderr is not subprocess.DEVNULL:
+                stderr.close()
+
+        uris = queue.Queue()
+        def read_output():
+            # Keeps draining stdout for the life of the helper so it can never block on a full pipe
+            for line in process.stdout:
+                if line.startswith("mongodb://"):
+                    uris.put(line.strip())
+                else:
+                    self.write_log(f"[shard {index} database] {line}")
+            uris.put(None)
+        threading.Thread(target=read_output, daemon=True).start()
+
+        try:
+            uri = uris.get(timeout=DATABASE_START_TIMEOUT)
+        except queue.Empty:
+            uri = None
+            reason = f"no URI after {DATABASE_START_TIMEOUT}s"
+        else:
+            reason = "the helper exited without a URI"
+        if uri is None:
+            process.kill()
+            process.wait()
+            self.write_log(f"[shard {index}] database failed to start: {reason}\n")
+            raise StepError(f"Could not start the in-memory MongoDB for test shard {index}: {reason} (see {self.log_path})")
+        return process, uri
+
+    def stop_database(self, process):
+        process.stdin.close()
+        killer = threading.Timer(30, process.kill) # Do not hang setup on a stuck mongod
+        killer.start()
+        try:
+            self.wait_for(process)
+        finally:
+            killer.cancel()
+
+    def run_shard(self, index, count, files, output_dir):
+        results_path = os.path.join(output_dir, f"shard-{index}.json")
+        database, uri = self.start_database(index)
+        start = time.perf_counter()
+        try:
+            env = dict(self.mongodb_env(), DB_URL=uri, DB_NAME=f"vibe-test-shard-{index}")
+            command = ["pnpm", "exec", "vitest", "run", "--no-file-parallelism", "--reporter=default", "--reporter=json",
+                       f"--outputFile.json={results_path}", *files]
+            self.write_log(f"[shard {index}] $ {' '.join(command)}\n")
+            process = subprocess.Popen(command, cwd=self.backend_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       text=True, env=env, shell=(platform.system() == "Windows"))
+            finished = 0
+            for line in process.stdout:
+                self.write_log(f"[shard {index}] {line}")
+                match = VITEST_FILE_PATTERN.match(line)
+                if match:
+                    finished += 1
+                    mark = "[green]✓[/green]" if match.group(1) == "✓" else "[red]✗[/red]"
+                    console.print(f"[shard {index}/{count}] {mark} {match.group(2)} ({finished}/{len(files)})")
+            self.wait_for(process)
+        finally:
+            self.stop_database(database)
+        return self.read_results(results_path, files), time.perf_counter() - start
+
+    def read_results(self, results_path, files):
+        results = {path: {"status": "failed", "duration_seconds": DEFAULT_TEST_SECONDS, "tests": 0,
+                          "failed_tests": ["(no result reported; see the step log)"]} for path in files}
+        try:
+            with open(results_path) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return results
+        for file_result in report.get("testResults", []):
+            path = os.path.relpath(file_result["name"], self.backend_dir).replace(os.sep, "/")
+            if path not in results:
+                continue
+            assertions = file_result.get("assertionResults", [])
+            failed = [assertion.get("fullName", assertion.get("title", "")) for assertion in assertions if assertion.get("status") == "failed"]
+            results[path] = {
+                "status": "passed" if file_result.get("status") == "passed" and not failed else "failed",
+                "duration_seconds": round((file_result.get("endTime", 0) - file_result.get("startTime", 0)) / 1000, 3),
+                "tests": len(assertions),
+                "failed_tests": failed if failed or file_result.get("status") == "passed" else [file_result.get("message", "failed")],
+            }
+        return results
 
     def run(self, state):
-        subprocess.run(["pnpm", "install"], cwd=self.frontend_dir, check=True, shell=(platform.system() == "Windows"))
+        files = self.test_files()
+        previous = state.get("test_results", {})
+        fingerprints = self.file_fingerprints(files)
+        to_run = [path for path in files
+                  if previous.get(path, {}).get("status") != "passed" or previous[path].get("fingerprint") != fingerprints[path]]
+        # Last run's failures first, then the longest files, so both surface early
+        to_run.sort(key=lambda path: (previous.get(path, {}).get("status") != "failed",
+                                      -previous.get(path, {}).get("duration_seconds", DEFAULT_TEST_SECONDS)))
+        console.print(f"{len(files)} test file(s): {len(files) - len(to_run)} unchanged since passing, {len(to_run)} to run.")
+
+        results, rows, shard_errors = {}, [], []
+        if to_run:
+            shard_count = int(os.environ.get("VIBE_TEST_SHARDS", 0)) or max(1, (os.cpu_count() or 2) // 2)
+            shards = self.make_shards(to_run, previous, min(shard_count, len(to_run)))
+            with tempfile.TemporaryDirectory() as output_dir, ThreadPoolExecutor(max_workers=len(shards)) as pool:
+                futures = [pool.submit(self.run_shard, index, len(shards), shard, output_dir) for index, shard in enumerate(shards, 1)]
+                for index, (future, shard) in enumerate(zip(futures, shards), 1):
+                    try:
+                        shard_results, seconds = future.result()
+                    except Exception as e:
+                        # Keep collecting, so the shards that did finish are still recorded below
+                        shard_errors.append(str(e))
+                        rows.append([str(index), str(len(shard)), "-", "-", "-", "[red]error[/red]"])
+                        continue
+                    results.update(shard_results)
+                    passed = sum(result["status"] == "passed" for result in shard_results.values())
+                    rows.append([str(index), str(len(shard)), str(passed), str(len(shard) - passed),
+                                 str(sum(result["tests"] for result in shard_results.values())), format_seconds(seconds)])
+
+        with state.transaction():
+            test_results = {path: previous[path] for path in files if path in previous}
+            for path, result in results.items():
+                test_results[path] = {**result, "fingerprint": fingerprints[path]}
+            state.update("test_results", test_results)
+
+        if rows:
+            print_table("Backend Test Shards", [("Shard", "center"), ("Files", "right"), ("Passed", "right"), ("Failed", "right"),
+                                                ("Tests", "right"), ("Time", "right")], rows)
+        if shard_errors:
+            raise StepError("; ".join(shard_errors))
+        failed = [path for path in files if test_results[path]["status"] != "passed"]
+        if failed:
+            for path in failed:
+                console.print(f"[red]✗ {path}[/red]")
+                for test in test_results[path]["failed_tests"][:5]:
+                    console.print(f"[red]    {test}[/red]")
+            raise StepError(f"{len(failed)} test file(s) failed. Please fix and re-run the setup; passing files will be skipped.")
+        console.print("[green]✅ All tests passed! Backend setup complete.")
         state.update(self.name, True)
 
 # ------------------ Pipeline Manager ------------------
 
+STATUS_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "failed": "❌", "cancelled": "⏭"}
+
+class LiveReporter:
+    """Live multi-row rich display, one row per step."""
+    def __init__(self):
+        from rich.progress import Progress, TextColumn, TimeElapsedColumn
+        self.progress = Progress(
+            TextColumn("{task.fields[icon]}"),
+            TextColumn("[bold]{task.description:<24}"),
+            TextColumn("{task.fields[status]}"),
+            TimeElapsedColumn(),
+            console=rich_console(),
+        )
+        self.tasks = {}
+
+    def add(self, step, status, detail):
+        self.tasks[step.name] = self.progress.add_task(step.name, total=1, start=False, completed=int(status == "done"),
+                                                       icon=STATUS_ICONS[status], status=detail)
+
+    def update(self, step, status, detail):
+        task_id = self.tasks[step.name]
+        if status == "running":
+            self.progress.start_task(task_id)
+        elif status in ("done", "failed", "cancelled"):
+            self.progress.update(task_id, completed=1)
+            self.progress.stop_task(task_id)
+        self.progress.update(task_id, icon=STATUS_ICONS[status], status=detail)
+
+    def start(self):
+        self.progress.start()
+
+    def stop(self):
+        self.progress.stop()
+
+class LogReporter:
+    """Headless progress: one log line (or JSON object) per step state change."""
+    def add(self, step, status, detail):
+        if status == "done":
+            self.update(step, "skipped", detail)
+
+    def update(self, step, status, detail):
+        console.emit({"step": step.name, "status": status, "message": f"{step.name}: {detail}" if detail != status else step.name})
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
 class SetupPipeline:
-    def __init__(self, steps: List[PipelineStep], state: SetupState):
+    """
+    Runs steps as soon as the steps they depend on are done. Background steps share a thread pool
+    (they mostly wait on subprocesses), interactive steps run one at a time on the main thread, and
+    when a step fails everything depending on it is cancelled while unrelated steps carry on.
+    Background completions are handled by future callbacks, so dependents keep starting while the
+    main thread waits on a prompt; their console output is held until the prompt is answered.
+    """
+    def __init__(self, steps: List[PipelineStep], state: SetupState, max_workers: int = 4,
+                 selected: Optional[List[str]] = None, headless: bool = False):
         self.steps = steps
         self.state = state
+        self.max_workers = max_workers
+        # Steps left out of a selection count as done for their dependents
+        self.selected = set(selected) if selected is not None else None
+        self.headless = headless
+        self.statuses: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+        self.running = {} # Future -> background step
+        self.stopping = False # Set on Ctrl+C: nothing new is started
+        self.condition = threading.Condition(threading.RLock())
+        self.validate()
 
-    def print_progress_table(self, current_step_name):
-        table = Table(title="ViBe Setup Progress", box=box.ROUNDED)
-        table.add_column("#", justify="center")
-        table.add_column("Step", justify="left")
-        table.add_column("Description", justify="left")
-        table.add_column("Status", justify="center")
+    def validate(self):
+        names = {step.name for step in self.steps}
+        unknown = sorted((self.selected or set()) - names)
+        if unknown:
+            raise ValueError(f"Unknown step(s) selected: {', '.join(unknown)}. Steps are: {', '.join(step.name for step in self.steps)}")
+        # Requiring prerequisites to be listed first also rules out dependency cycles
+        seen = set()
+        for step in self.steps:
+            missing = [name for name in step.depends_on if name not in names]
+            if missing:
+                raise ValueError(f"Step '{step.name}' depends on unknown step(s): {', '.join(missing)}")
+            later = [name for name in step.depends_on if name not in seen]
+            if later:
+                raise ValueError(f"Step '{step.name}' must be listed after {', '.join(later)}")
+            seen.add(step.name)
 
+    def print_progress_table(self):
+        columns = [("#", "center"), ("Step", "left"), ("Description", "left"), ("Status", "center")]
+        rows = []
         for index, step in enumerate(self.steps, 1):
-            if self.state.get(step.name):
-                status = "✅"
-            elif step.name == current_step_name:
-                status = "🔄"
-            else:
-                status = "⏳"
-            table.add_row(str(index), step.name, step.description, status)
+            status = "done" if self.state.get(step.name) else self.statuses.get(step.name, "pending")
+            rows.append([str(index), step.name, step.description, STATUS_ICONS[status]])
+        print_table("ViBe Setup Progress", columns, rows)
 
-        console.print(table)
+    def ready_steps(self):
+        # Steps are listed in dependency order, so one pass also cancels dependents of cancelled steps
+        ready = []
+        for step in self.steps:
+            if self.statuses[step.name] != "pending":
+                continue
+            blocked = [name for name in step.depends_on if self.statuses[name] in ("failed", "cancelled")]
+            if blocked:
+                self.cancel(step, f"prerequisite failed: {', '.join(blocked)}")
+            elif all(self.statuses[name] == "done" for name in step.depends_on):
+                ready.append(step)
+        return ready
+
+    def cancel(self, step, reason):
+        self.statuses[step.name] = "cancelled"
+        self.errors[step.name] = reason
+        self.set_row(step, "cancelled", reason)
+
+    def set_row(self, step, status, detail=""):
+        self.reporter.update(step, status, detail or status)
+
+    def execute(self, step):
+        if step.instructions and step.foreground:
+            step.display_instructions()
+        # Sizing node_modules is not free, so it stays outside the timed region
+        watched = step.node_modules_dirs()
+        size_before = sum(directory_bytes(path) for path in watched)
+        step.cpu_seconds = 0.0
+        started = time.time()
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            step.run(self.state)
+            status = "done"
+        except BaseException:
+            # A step that passed before must not keep its old result when a re-run fails
+            step.record_failure(self.state)
+            raise
+        finally:
+            wall_seconds = time.perf_counter() - start
+            with self.condition: # Background steps finish on several worker threads at once
+                self.step_seconds += wall_seconds
+            self.state.record_timing(step.name, {
+                "started": started,
+                "wall_seconds": round(wall_seconds, 3),
+                "cpu_seconds": round(step.cpu_seconds, 3),
+                "node_modules_bytes": sum(directory_bytes(path) for path in watched) - size_before if watched else None,
+                "status": status,
+                "interactive": step.foreground,
+            })
+        # Installs can change tool versions, so fingerprint from fresh values
+        tool_version.cache_clear()
+        step.record_fingerprint(self.state)
+
+    def finish(self, step, error=None):
+        if error is None:
+            self.statuses[step.name] = "done"
+            self.set_row(step, "done")
+        else:
+            self.statuses[step.name] = "failed"
+            self.errors[step.name] = str(error) or type(error).__name__
+            self.set_row(step, "failed", self.errors[step.name])
+
+    def schedule(self):
+        """Starts every ready background step and returns the ready interactive ones. Call with the condition held."""
+        if self.stopping:
+            return []
+        ready = self.ready_steps()
+        for step in ready:
+            if not step.foreground:
+                self.statuses[step.name] = "running"
+                self.set_row(step, "running", f"running (log: {step.log_path})")
+                future = self.executor.submit(self.execute, step)
+                self.running[future] = step
+                future.add_done_callback(self.background_finished)
+        return [step for step in ready if step.foreground]
+
+    def background_finished(self, future):
+        # Runs on the worker thread, so dependents start even while the main thread is in a prompt
+        with self.condition:
+            try:
+                step = self.running.pop(future)
+                if not future.cancelled():
+                    self.finish(step, future.exception())
+                    self.schedule()
+            finally:
+                self.condition.notify_all()
 
     def run(self):
-        serializable_steps = [{"name": step.name, "description": step.description} for step in self.steps]
-        self.state.update("steps", serializable_steps)
+        self.reporter = LogReporter() if self.headless else LiveReporter()
+        os.makedirs(LOG_DIR, exist_ok=True)
+        # One state write for the step list and any adopted fingerprints
+        with self.state.transaction():
+            serializable_steps = [{"name": step.name, "description": step.description} for step in self.steps]
+            self.state.update("steps", serializable_steps)
+            for step in self.steps:
+                if self.selected is not None and step.name not in self.selected:
+                    self.statuses[step.name] = "done"
+                    self.reporter.add(step, "done", "not selected")
+                    continue
+                reason = step.run_reason(self.state)
+                done = reason is None
+                if done and step.recorded_fingerprint(self.state) is None:
+                    step.record_fingerprint(self.state)
+                self.statuses[step.name] = "done" if done else "pending"
+                self.reporter.add(step, self.statuses[step.name], "up to date" if done else f"waiting ({reason})")
+                step.log_path = os.path.join(LOG_DIR, step.name.replace(" ", "_") + ".log")
+            self.skipped = sum(status == "done" for status in self.statuses.values())
 
-        for step in self.steps:
-            if step.should_run(self.state):
-                clear_screen()
-                self.print_progress_table(step.name)
-                if step.instructions:
-                    step.display_instructions()
-                step.run(self.state)
-        clear_screen()
-        self.print_progress_table("done")
+        self.step_seconds = 0.0
+        run_start = time.perf_counter()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.reporter.start()
+        try:
+            while True:
+                with self.condition:
+                    interactive = self.schedule()
+                    while not interactive and self.running:
+                        self.condition.wait(0.2)
+                        interactive = self.schedule()
+                    if not interactive:
+                        break
+                    step = interactive[0]
+                    self.statuses[step.name] = "running"
+                    self.set_row(step, "running", "waiting for input")
+                # Prompts need the terminal; background steps keep going with their output in log files
+                self.reporter.stop()
+                try:
+                    with hold_output():
+                        self.execute(step)
+                    error = None
+                except Exception as e:
+                    error = e
+                finally:
+                    self.reporter.start()
+                with self.condition:
+                    self.finish(step, error)
+        except KeyboardInterrupt:
+            # Let running subprocesses receive the interrupt too, but start nothing new
+            with self.condition:
+                self.stopping = True
+                for future in list(self.running):
+                    future.cancel()
+                for step in self.steps:
+                    if self.statuses[step.name] in ("pending", "running"):
+                        self.cancel(step, "interrupted")
+            raise
+        finally:
+            self.reporter.stop()
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            steps_run = sum(status in ("done", "failed") for status in self.statuses.values()) - self.skipped
+            if steps_run:
+                with self.state.transaction():
+                    runs = self.state.get("runs", []) + [{
+                        "started": time.time() - (time.perf_counter() - run_start),
+                        "wall_seconds": round(time.perf_counter() - run_start, 3),
+                        "step_seconds": round(self.step_seconds, 3),
+                        "steps_run": steps_run,
+                    }]
+                    self.state.update("runs", runs[-TIMING_HISTORY:])
+
+        if self.headless:
+            statuses = {name: "not selected" if self.selected is not None and name not in self.selected else status
+                        for name, status in self.statuses.items()}
+            console.emit({"event": "summary", "statuses": statuses, "errors": self.errors,
+                          "message": "Setup finished" if not self.errors else f"Setup failed: {', '.join(self.errors)}"})
+        else:
+            self.print_progress_table()
+        if self.errors:
+            for name, error in self.errors.items():
+                console.print(f"[red]{STATUS_ICONS[self.statuses[name]]} {name}: {error}[/red]")
+            console.print("\n[bold red]Setup did not complete. Fix the errors above and re-run the setup; finished steps will be skipped.[/bold red]")
+            sys.exit(1)
         console.print("\n[bold green]🎉 Setup completed![/bold green]")
         console.print("\n[bold blue]👉 Run `pnpm run dev` in the backend and frontend directories to start the servers.[/bold blue]")
 
+    def print_plan(self):
+        columns = [("#", "center"), ("Step", "left"), ("Action", "center"), ("Reason", "left")]
+        rows = []
+        for index, step in enumerate(self.steps, 1):
+            if self.selected is not None and step.name not in self.selected:
+                rows.append([str(index), step.name, "skip", "not selected"])
+                continue
+            reason = step.run_reason(self.state)
+            action = "[yellow]run[/yellow]" if reason else "[green]skip[/green]"
+            rows.append([str(index), step.name, action, reason or "up to date"])
+        print_table("ViBe Setup Plan", columns, rows)
+
 # ------------------ Main ------------------
 
-def main():
-    if len(sys.argv) > 1 and sys.argv[1] == "--summary":
-        state = SetupState()
-        state.show_summary()
-        return
+def split_names(value):
+    return [name.strip() for name in value.split(",") if name.strip()] if value else None
 
-    backend_dir = os.path.join(os.getcwd(), "backend")
-    frontend_dir = os.path.join(os.getcwd(), "frontend")
-    state = SetupState()
+def load_headless_config(path=None, overrides=None):
+    """
+    Settings for an unattended run, from (lowest to highest precedence) defaults, a JSON config
+    file, environment variables and command-line overrides:
+
+        environment   VIBE_ENVIRONMENT   "Development" (default) or "Production"
+        db_url        DB_URL             written to backend/.env when it does not exist yet
+        steps         VIBE_STEPS         comma-separated step names to run (default: all)
+        skip_steps    VIBE_SKIP_STEPS    comma-separated step names to leave out
+        log_format    VIBE_LOG_FORMAT    "plain" (default) or "json"
+        jobs          VIBE_JOBS          maximum concurrent steps
+    """
+    config = {"environment": "Development", "db_url": None, "steps": None, "skip_steps": [], "log_format": "plain", "jobs": 4}
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    environment = {
+        "environment": os.environ.get("VIBE_ENVIRONMENT"),
+        "db_url": os.environ.get("DB_URL"),
+        "steps": split_names(os.environ.get("VIBE_STEPS")),
+        "skip_steps": split_names(os.environ.get("VIBE_SKIP_STEPS")),
+        "log_format": os.environ.get("VIBE_LOG_FORMAT"),
+        "jobs": int(os.environ["VIBE_JOBS"]) if os.environ.get("VIBE_JOBS") else None,
+    }
+    config.update({key: value for key, value in environment.items() if value is not None})
+    config.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    if config["environment"] not in ("Development", "Production"):
+        raise ValueError(f"Unknown environment '{config['environment']}'")
+    if config["log_format"] not in ("plain", "json"):
+        raise ValueError(f"Unknown log format '{config['log_format']}'")
+    return config
 
-    development_steps = [
+def create_development_steps(root_dir):
+    backend_dir = os.path.join(root_dir, "backend")
+    return [
         ToolchainCheckStep(),
         FirebaseLoginStep(),
         FirebaseEmulatorsStep(backend_dir),
         EnvFileStep(backend_dir),
-        PackageInstallStep(backend_dir),
+        WorkspaceInstallStep(root_dir),
         MongoDBBinaryStep(backend_dir),
         TestStep(backend_dir),
-        FrontendPackageInstallStep(frontend_dir)
     ]
 
+def main():
+    parser = argparse.ArgumentParser(description="ViBe setup wizard")
+    parser.add_argument("--summary", action="store_true", help="Show the progress of previous setup runs and exit")
+    parser.add_argument("--profile", action="store_true", help="Show per-step timings of previous setup runs, slowest first")
+    parser.add_argument("--plan", action="store_true", help="Show which steps would run and why, without running them")
+    parser.add_argument("--jobs", type=int, help="Maximum number of setup steps running at the same time (default: 4)")
+    parser.add_argument("--headless", action="store_true", help="Run without prompts or live display (also: VIBE_HEADLESS=1)")
+    parser.add_argument("--config", help="JSON file with headless settings; implies --headless")
+    parser.add_argument("--steps", help="Comma-separated names of the steps to run")
+    parser.add_argument("--skip-steps", help="Comma-separated names of steps to leave out")
+    parser.add_argument("--log-format", choices=["plain", "json"], help="Headless log output format")
+    args = parser.parse_args()
+
+    # Reports only read the state file, so they never load the UI stack
+    if args.summary or args.profile:
+        use_console(PlainConsole())
+        state = SetupState()
+        state.show_summary() if args.summary else state.print_profile()
+        return
+
+    headless = args.headless or args.config is not None or os.environ.get("VIBE_HEADLESS") == "1"
+    overrides = {"steps": split_names(args.steps), "skip_steps": split_names(args.skip_steps), "log_format": args.log_format, "jobs": args.jobs}
+    try:
+        config = load_headless_config(args.config, overrides) if headless else {**load_headless_config(None, overrides), "log_format": None}
+    except (OSError, ValueError) as e:
+        print(f"Invalid setup configuration: {e}")
+        sys.exit(2)
+    if headless or args.plan:
+        use_console(PlainConsole(config["log_format"]))
+
+    state = SetupState()
+    development_steps = create_development_steps(os.getcwd())
+    selected = None
+    if config["steps"] is not None or config["skip_steps"]:
+        names = [step.name for step in development_steps]
+        unknown = sorted((set(config["steps"] or []) | set(config["skip_steps"])) - set(names))
+        if unknown:
+            console.print(f"[red]❌ Unknown step(s): {', '.join(unknown)}. Steps are: {', '.join(names)}[/red]")
+            sys.exit(2)
+        selected = [name for name in names if (config["steps"] is None or name in config["steps"]) and name not in config["skip_steps"]]
+    development_pipeline = SetupPipeline(development_steps, state, max_workers=config["jobs"], selected=selected, headless=headless)
+
+    if args.plan:
+        development_pipeline.print_plan()
+        return
+
     welcome_step = WelcomeStep()
+    if headless:
+        welcome_step.config = config
+        for step in development_steps:
+            step.config = config
     environment = welcome_step.run(state)
     if environment == "Development":
-        development_pipeline = SetupPipeline(development_steps, state)
         development_pipeline.run()
     elif environment == "Production":
         console.print("[red]Production setup is not ready yet.[/red]")
@@ -0,0 +1,296 @@
+# transcribe_whisper_onnx.py
+"""
+Offline batch transcription over the Whisper ONNX export written by convert_whisper_to_onnx.py.
+
+Audio files are memory-mapped, cut into 30 s chunks, turned into log-mel features for a whole
+batch of chunks at once, and decoded with the exported encoder / KV-cache decoder. Files are
+fanned out over a process pool, and each transcript is written to its own JSON file as soon as
+it is done, so re-running the command after a crash only processes the files that are missing.
+
+Usage:
+    python transcribe_whisper_onnx.py recordings/ --output-dir transcripts --workers 4 --language en
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+N_FFT = 400
+HOP_LENGTH = 160
+CHUNK_SECONDS = 30
+CHUNK_SAMPLES = CHUNK_SECONDS * SAMPLE_RATE # 480000 samples -> 3000 frames
+AUDIO_EXTENSIONS = (".wav", ".pcm")
+
+# ------------------ Audio input ------------------
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def open_audio(path, pcm_sample_rate=SAMPLE_RATE, pcm_channels=1, pcm_dtype="int16"):
+    """
+    Memory-maps a WAV file (PCM 16/32-bit or 32-bit float) or a headerless .pcm file.
+    Returns (samples, sample_rate) where samples is a read-only (frames, channels) np.memmap;
+    nothing is read from disk until a chunk is sliced.
+    """
+    if not path.lower().endswith(".wav"):
+        dtype = np.dtype(pcm_dtype)
+        frames = os.path.getsize(path) // (dtype.itemsize * pcm_channels)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(frames, pcm_channels)), pcm_sample_rate
+
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                    # The actual format is the first two bytes of the sub-format GUID
+                    format_tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (format_tag, channels, sample_rate, bits)
+            elif chunk_id == b"data":
+                data_offset, data_size = f.tell(), chunk_size
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR) # Chunks are word aligned
+    if fmt is None:
+        raise ValueError(f"{path} has no fmt chunk")
+
+    format_tag, channels, sample_rate, bits = fmt
+    if format_tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        dtype = np.dtype(f"<i{bits // 8}")
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        dtype = np.dtype("<f4")
+    else:
+        raise ValueError(f"{path}: unsupported WAV format (tag {format_tag}, {bits} bits)")
+    # Chunks after the data (LIST/INFO, id3, cue, ...) are not audio, so the map ends at the data size.
+    # Streaming writers leave it at 0 or 0xFFFFFFFF, and truncated files are shorter than it says;
+    # both fall back to the rest of the file.
+    available = os.path.getsize(path) - data_offset
+    if data_size in (0, 0xFFFFFFFF) or data_size > available:
+        data_size = available
+    frames = data_size // (dtype.itemsize * channels)
+    return np.memmap(path, dtype=dtype, mode="r", offset=data_offset, shape=(frames, channels)), sample_rate
+
+def to_mono_float(samples):
+    # (frames, channels) integer or float samples -> (frames,) float32 in [-1, 1]
+    audio = samples.astype(np.float32)
+    if np.issubdtype(samples.dtype, np.integer):
+        audio /= float(np.iinfo(samples.dtype).max) + 1
+    return audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+
+def iter_audio_chunks(samples, sample_rate):
+    """Yields consecutive 30 s chunks of 16 kHz mono float32 audio; the last one is zero padded."""
+    source_chunk = CHUNK_SECONDS * sample_rate
+    for begin in range(0, len(samples), source_chunk):
+        audio = to_mono_float(samples[begin:begin + source_chunk])
+        if sample_rate != SAMPLE_RATE:
+            target_length = int(round(len(audio) * SAMPLE_RATE / sample_rate))
+            audio = np.interp(np.arange(target_length) * (sample_rate / SAMPLE_RATE), np.arange(len(audio)), audio).astype(np.float32)
+        chunk = np.zeros(CHUNK_SAMPLES, dtype=np.float32)
+        chunk[:len(audio)] = audio[:CHUNK_SAMPLES]
+        yield chunk, len(audio) / SAMPLE_RATE
+
+# ------------------ Log-mel features ------------------
+
+def hz_to_mel(frequencies):
+    # Slaney mel scale: linear below 1 kHz, logarithmic above (librosa's default, used by Whisper)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    mels = frequencies / (200.0 / 3)
+    log_region = frequencies >= 1000.0
+    mels[log_region] = 15.0 + np.log(frequencies[log_region] / 1000.0) / (np.log(6.4) / 27.0)
+    return mels
+
+def mel_to_hz(mels):
+    mels = np.asarray(mels, dtype=np.float64)
+    frequencies = mels * (200.0 / 3)
+    log_region = mels >= 15.0
+    frequencies[log_region] = 1000.0 * np.exp((np.log(6.4) / 27.0) * (mels[log_region] - 15.0))
+    return frequencies
+
+def mel_filter_bank(n_mels, n_fft=N_FFT, sample_rate=SAMPLE_RATE):
+    """Slaney-normalised triangular mel filters of shape (n_mels, n_fft // 2 + 1)."""
+    fft_frequencies = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+    mel_points = mel_to_hz(np.linspace(hz_to_mel([0.0])[0], hz_to_mel([sample_rate / 2])[0], n_mels + 2))
+    widths = np.diff(mel_points)
+    ramps = mel_points[:, np.newaxis] - fft_frequencies[np.newaxis, :]
+    lower = -ramps[:-2] / widths[:-1, np.newaxis]
+    upper = ramps[2:] / widths[1:, np.newaxis]
+    filters = np.maximum(0, np.minimum(lower, upper))
+    filters *= (2.0 / (mel_points[2:] - mel_points[:-2]))[:, np.newaxis]
+    return filters.astype(np.float32)
+
+def log_mel_spectrogram(chunks, mel_filters):
+    """
+    Whisper log-mel features for a batch of 30 s chunks in one vectorized pass.
+    chunks: (batch_size, 480000) float32 -> (batch_size, n_mels, 3000) float32
+    """
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)).astype(np.float32) # Periodic Hann
+    padded = np.pad(chunks, ((0, 0), (N_FFT // 2, N_FFT // 2)), mode="reflect")
+    # Strided view of every frame; the trailing frame is dropped as in Whisper
+    frames = np.lib.stride_tricks.sliding_window_view(padded, N_FFT, axis=1)[:, ::HOP_LENGTH][:, :CHUNK_SAMPLES // HOP_LENGTH]
+    spectrum = np.fft.rfft(frames * window, axis=-1)
+    power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32)
+    mel = np.matmul(power, mel_filters.T) # (batch_size, 3000, n_mels)
+    log_mel = np.log10(np.maximum(mel, 1e-10))
+    log_mel = np.maximum(log_mel, log_mel.max(axis=(1, 2), keepdims=True) - 8.0)
+    return np.ascontiguousarray(((log_mel + 4.0) / 4.0).transpose(0, 2, 1), dtype=np.float32)
+
+# ------------------ Transcription ------------------
+
+# Per-process model state, created once by init_worker()
+worker_state = {}
+
+def init_worker(model_dir, intra_op_threads, language, num_beams, batch_size):
+    import onnxruntime as ort
+    from convert_whisper_to_onnx import WhisperOnnxModel
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    model = WhisperOnnxModel(model_dir, session_options=options)
+    tokenizer = None
+    try:
+        from transformers import WhisperTokenizer
+        tokenizer = WhisperTokenizer.from_pretrained(model_dir)
+    except Exception:
+        print(f"No tokenizer found in {model_dir}; transcripts will contain token ids only.")
+    worker_state.update({
+        "model": model,
+        "tokenizer": tokenizer,
+        "mel_filters": mel_filter_bank(model.config["num_mel_bins"]),
+        "prompt_ids": model.build_prompt_ids(language),
+        "num_beams": num_beams,
+        "batch_size": batch_size,
+    })
+
+def decode_batch(chunks):
+    model = worker_state["model"]
+    input_features = log_mel_spectrogram(np.stack(chunks), worker_state["mel_filters"])
+    if worker_state["num_beams"] > 1:
+        return model.beam_search(input_features, worker_state["num_beams"], prompt_ids=worker_state["prompt_ids"])
+    return model.greedy_decode(input_features, prompt_ids=worker_state["prompt_ids"])
+
+def transcribe_file(audio_path, output_path, pcm_sample_rate):
+    """Transcribes one file in batches of chunks and writes its JSON transcript atomically."""
+    start = time.perf_counter()
+    samples, sample_rate = open_audio(audio_path, pcm_sample_rate=pcm_sample_rate)
+    tokenizer = worker_state["tokenizer"]
+    segments = []
+    pending = []
+    offset = 0.0
+
+    def flush():
+        for (chunk_start, duration, _), tokens in zip(pending, decode_batch([chunk for _, _, chunk in pending])):
+            segment = {"start": round(chunk_start, 2), "end": round(chunk_start + duration, 2), "tokens": tokens}
+            if tokenizer is not None:
+                segment["text"] = tokenizer.decode(tokens, skip_special_tokens=True).strip()
+            segments.append(segment)
+        pending.clear()
+
+    for chunk, duration in iter_audio_chunks(samples, sample_rate):
+        pending.append((offset, duration, chunk))
+        offset += duration
+        if len(pending) == worker_state["batch_size"]:
+            flush()
+    if pending:
+        flush()
+
+    stat = os.stat(audio_path)
+    transcript = {
+        "source": os.path.abspath(audio_path),
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "duration": round(offset, 2),
+        "text": " ".join(segment.get("text", "") for segment in segments).strip(),
+        "segments": segments,
+        "elapsed_seconds": round(time.perf_counter() - start, 2),
+    }
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(transcript, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, output_path) # A crash never leaves a half-written transcript behind
+    return audio_path, transcript["duration"], transcript["elapsed_seconds"]
+
+def find_audio_files(inputs):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                files += [os.path.join(root, name) for name in sorted(names) if name.lower().endswith(AUDIO_EXTENSIONS)]
+        else:
+            files.append(item)
+    return sorted(files)
+
+def output_path_for(audio_path, input_root, output_dir):
+    relative = os.path.relpath(os.path.abspath(audio_path), input_root)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + ".json")
+
+def is_done(audio_path, output_path):
+    # A transcript counts as done only if it was made from the current version of the audio file
+    if not os.path.exists(output_path):
+        return False
+    try:
+        with open(output_path) as f:
+            transcript = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stat = os.stat(audio_path)
+    return transcript.get("source_size") == stat.st_size and transcript.get("source_mtime") == stat.st_mtime
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-transcribe audio files with the Whisper ONNX export")
+    parser.add_argument("inputs", nargs="+", help="Audio files (.wav / raw 16-bit .pcm) or directories")
+    parser.add_argument("--model-dir", default="whisper_onnx")
+    parser.add_argument("--output-dir", default="transcripts")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--batch-size", type=int, default=8, help="30 s chunks per encoder/decoder call")
+    parser.add_argument("--language", help="Language code such as 'en'; detected by the model when omitted")
+    parser.add_argument("--beams", type=int, default=1, help="Beam width; 1 uses greedy decoding")
+    parser.add_argument("--pcm-sample-rate", type=int, default=SAMPLE_RATE, help="Sample rate of headerless .pcm input")
+    parser.add_argument("--force", action="store_true", help="Re-transcribe files that already have a transcript")
+    args = parser.parse_args()
+
+    files = find_audio_files(args.inputs)
+    if not files:
+        print("No audio files found.")
+        return
+    input_root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    jobs = [(path, output_path_for(path, input_root, args.output_dir)) for path in files]
+    todo = [(path, output) for path, output in jobs if args.force or not is_done(path, output)]
+    print(f"{len(files)} file(s) found, {len(files) - len(todo)} already transcribed, {len(todo)} to go.")
+    if not todo:
+        return
+
+    workers = max(1, min(args.workers, len(todo)))
+    intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(args.model_dir, intra_op_threads, args.language, args.beams, args.batch_size)) as pool:
+        futures = {pool.submit(transcribe_file, path, output, args.pcm_sample_rate): path for path, output in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                path, duration, elapsed = future.result()
+                print(f"[{done}/{len(todo)}] {path}: {duration:.0f}s of audio in {elapsed:.1f}s")
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(todo)}] {futures[future]}: failed: {e}")
+    if failures:
+        print(f"{failures} file(s) failed; re-run the same command to retry them.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()